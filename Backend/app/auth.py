@@ -0,0 +1,309 @@
+import asyncio
+import hashlib
+import logging
+import os
+import secrets
+import time
+from typing import Any, Dict, MutableMapping, Optional
+
+import jwt
+from dotenv import load_dotenv
+
+from app.db import redis_client
+from app.http_client import get_http_client
+from app.local_cache import LOCAL_CACHE, invalidate_cache
+from app.redis_func import release_lock
+from app.singleflight import single_flight
+from app.utils import json_dumps, json_loads
+
+load_dotenv()
+
+# OAuth config
+CLIENT_ID = os.getenv("OAUTH_CLIENT_ID")
+AUTH_URL = os.getenv("OAUTH_AUTH_URL")
+TOKEN_URL = os.getenv("OAUTH_TOKEN_URL")
+USERINFO_URL = os.getenv("OAUTH_USERINFO_URL")
+REDIRECT_URI = os.getenv("OAUTH_REDIRECT_URI")
+LOGOUT_URL = os.getenv("OAUTH_LOGOUT_URL")
+# Local access token validation; without a JWKS URL every check goes to USERINFO_URL
+JWKS_URL = os.getenv("OAUTH_JWKS_URL")
+TOKEN_ISSUER = os.getenv("OAUTH_ISSUER")
+TOKEN_AUDIENCE = os.getenv("OAUTH_AUDIENCE")
+# Clock skew (seconds) tolerated on exp/nbf/iat
+TOKEN_LEEWAY = int(os.getenv("OAUTH_TOKEN_LEEWAY", "30"))
+# Least time between two key set fetches, so tokens with made-up key ids
+# cannot make us hammer the provider
+JWKS_MIN_REFRESH_INTERVAL = float(os.getenv("OAUTH_JWKS_MIN_REFRESH_INTERVAL", "60"))
+
+# Claims that describe the token rather than the user; left out of what /me returns
+TOKEN_CLAIMS = frozenset(
+    (
+        "exp", "iat", "nbf", "auth_time", "jti", "iss", "aud", "typ", "azp",
+        "sid", "session_state", "acr", "scope", "allowed-origins",
+    )
+)
+
+# Longest a worker may hold the cross-worker refresh lock
+TOKEN_REFRESH_LOCK_TTL = int(os.getenv("TOKEN_REFRESH_LOCK_TTL", "15"))
+# How long a refresh result is kept for requests still carrying the old
+# refresh token (sent before the new session cookie reached the browser)
+TOKEN_REFRESH_RESULT_TTL = int(os.getenv("TOKEN_REFRESH_RESULT_TTL", "30"))
+# How long a refused refresh is remembered, so every waiter gets the same
+# answer without calling the provider again
+TOKEN_REFRESH_FAILURE_TTL = int(os.getenv("TOKEN_REFRESH_FAILURE_TTL", "10"))
+
+# Upper bound on how long a userinfo response is reused; never past the
+# token's own expiry
+USERINFO_CACHE_TTL = int(os.getenv("USERINFO_CACHE_TTL", "300"))
+
+REFRESH_LOCK_PREFIX = "auth:refresh:lock:"
+REFRESH_RESULT_PREFIX = "auth:refresh:result:"
+USERINFO_CACHE_PREFIX = "auth:userinfo:"
+
+
+class TokenRefreshError(Exception):
+    """The identity provider refused the refresh token."""
+
+    def __init__(self, status_code: int, detail: Any):
+        super().__init__(f"Token refresh failed with status {status_code}")
+        self.status_code = status_code
+        self.detail = detail
+
+
+class InvalidToken(Exception):
+    """The access token is a JWT that fails validation (signature, expiry, ...)."""
+
+
+class JWKSCache:
+    """The provider's signing keys by key id, fetched once per worker.
+
+    Refetched when a token names a key id we do not know (the provider rotated
+    its keys), at most once per JWKS_MIN_REFRESH_INTERVAL.
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self._keys: Dict[Optional[str], jwt.PyJWK] = {}
+        self._fetched_at: Optional[float] = None
+
+    async def _fetch(self):
+        response = await get_http_client().get(self.url)
+        response.raise_for_status()
+        keys = {}
+        for data in response.json().get("keys", []):
+            if data.get("use", "sig") != "sig":
+                continue
+            try:
+                keys[data.get("kid")] = jwt.PyJWK(data)
+            except jwt.PyJWKError as e:
+                logging.debug(f"Skipping unusable JWK {data.get('kid')}: {e}")
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+        logging.info(f"🔑 Loaded {len(keys)} signing keys from {self.url}")
+
+    async def get(self, kid: Optional[str]) -> Optional[jwt.PyJWK]:
+        key = self._keys.get(kid)
+        if key is None and (
+            self._fetched_at is None
+            or time.monotonic() - self._fetched_at >= JWKS_MIN_REFRESH_INTERVAL
+        ):
+            await single_flight(f"jwks:{self.url}", self._fetch)
+            key = self._keys.get(kid)
+        if key is None and kid is None and len(self._keys) == 1:
+            # A token without a key id can only mean the provider's only key
+            key = next(iter(self._keys.values()))
+        return key
+
+
+JWKS_CACHE = JWKSCache(JWKS_URL) if JWKS_URL else None
+
+
+async def access_token_claims(access_token: str) -> Optional[Dict[str, Any]]:
+    """Claims of a locally validated access token, without a network call.
+
+    Returns None when local validation is not possible (no OAUTH_JWKS_URL, or
+    an opaque token) so the caller can ask USERINFO_URL instead. Raises
+    InvalidToken for a JWT that is expired, badly signed or not ours.
+    """
+    if JWKS_CACHE is None:
+        return None
+    try:
+        header = jwt.get_unverified_header(access_token)
+    except jwt.DecodeError:
+        return None
+
+    try:
+        key = await JWKS_CACHE.get(header.get("kid"))
+    except Exception as e:
+        # Provider unreachable for the key set: let the caller fall back
+        logging.error(f"Error fetching signing keys: {e}")
+        return None
+    if key is None:
+        raise InvalidToken(f"Unknown signing key {header.get('kid')}")
+    try:
+        return jwt.decode(
+            access_token,
+            key=key.key,
+            algorithms=[key.algorithm_name],
+            audience=TOKEN_AUDIENCE,
+            issuer=TOKEN_ISSUER,
+            leeway=TOKEN_LEEWAY,
+            options={"verify_aud": TOKEN_AUDIENCE is not None},
+        )
+    except jwt.InvalidTokenError as e:
+        raise InvalidToken(str(e)) from e
+
+
+def user_claims(claims: Dict[str, Any]) -> Dict[str, Any]:
+    # The userinfo-shaped part of the token, as /me has always returned
+    return {name: value for name, value in claims.items() if name not in TOKEN_CLAIMS}
+
+
+def token_hash(token: str) -> str:
+    # Tokens are never used as cache or lock keys as-is
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def store_tokens(session: MutableMapping[str, Any], token_data: Dict[str, Any]):
+    session["access_token"] = token_data.get("access_token")
+    session["refresh_token"] = token_data.get("refresh_token")
+    session["access_token_expires_at"] = time.time() + token_data["expires_in"]
+
+
+async def _request_tokens(refresh_token: str) -> Dict[str, Any]:
+    response = await get_http_client().post(
+        TOKEN_URL,
+        data={
+            "grant_type": "refresh_token",
+            "refresh_token": refresh_token,
+            "client_id": CLIENT_ID,
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
+    if response.status_code != 200:
+        # Error bodies are not always JSON (proxies, HTML error pages)
+        try:
+            detail = response.json()
+        except ValueError:
+            detail = response.text or response.reason_phrase
+        raise TokenRefreshError(response.status_code, detail)
+    return response.json()
+
+
+def _refresh_outcome(cached: str) -> Dict[str, Any]:
+    outcome = json_loads(cached)
+    if "error" in outcome:
+        error = outcome["error"]
+        raise TokenRefreshError(error["status_code"], error["detail"])
+    return outcome["tokens"]
+
+
+async def _refresh_across_workers(refresh_token: str) -> Dict[str, Any]:
+    key = token_hash(refresh_token)
+    lock_key, result_key = f"{REFRESH_LOCK_PREFIX}{key}", f"{REFRESH_RESULT_PREFIX}{key}"
+    owner = secrets.token_hex(16)
+
+    try:
+        # Wait for the lock holder's outcome; if it dies without one, its lock
+        # expires after TOKEN_REFRESH_LOCK_TTL and the next waiter takes over
+        while True:
+            cached = await redis_client.get(result_key)
+            if cached is not None:
+                logging.debug("🔁 Token already refreshed by another request")
+                return _refresh_outcome(cached)
+            if await redis_client.set(lock_key, owner, nx=True, ex=TOKEN_REFRESH_LOCK_TTL):
+                break
+            await asyncio.sleep(0.05)
+    except TokenRefreshError:
+        raise
+    except Exception as e:
+        # Without Redis the refresh is still made, just not deduplicated
+        # across workers
+        logging.error(f"Error coordinating token refresh: {e}")
+        return await _request_tokens(refresh_token)
+
+    try:
+        try:
+            token_data = await _request_tokens(refresh_token)
+        except TokenRefreshError as e:
+            # A refusal is shared too, so waiters do not each ask again
+            outcome = {"error": {"status_code": e.status_code, "detail": e.detail}}
+            await redis_client.set(
+                result_key, json_dumps(outcome), ex=TOKEN_REFRESH_FAILURE_TTL
+            )
+            raise
+        await redis_client.set(
+            result_key, json_dumps({"tokens": token_data}), ex=TOKEN_REFRESH_RESULT_TTL
+        )
+        return token_data
+    finally:
+        await release_lock(lock_key, owner)
+
+
+async def refresh_tokens(refresh_token: str) -> Dict[str, Any]:
+    """Exchange a refresh token at TOKEN_URL, once per token.
+
+    Concurrent callers in this worker share one call (single_flight); other
+    workers wait on a Redis lock and then reuse the stored outcome, success
+    or refusal, so one expiry causes exactly one call to the identity
+    provider. Raises TokenRefreshError when the provider refuses.
+    """
+    return await single_flight(
+        f"token_refresh:{token_hash(refresh_token)}",
+        lambda: _refresh_across_workers(refresh_token),
+    )
+
+
+def userinfo_cache_key(access_token: str) -> str:
+    return f"{USERINFO_CACHE_PREFIX}{token_hash(access_token)}"
+
+
+async def _request_userinfo(access_token: str) -> Dict[str, Any]:
+    response = await get_http_client().get(
+        USERINFO_URL, headers={"Authorization": f"Bearer {access_token}"}
+    )
+    if response.status_code != 200:
+        raise InvalidToken(f"Userinfo request failed with status {response.status_code}")
+    return response.json()
+
+
+async def get_userinfo(access_token: str, expires_at: Optional[float]) -> Dict[str, Any]:
+    """USERINFO_URL's answer for the token, reused for as long as it is valid.
+
+    Cached in this worker's LOCAL_CACHE and in Redis under a hash of the
+    token, for at most USERINFO_CACHE_TTL and never past expires_at (the
+    session's access_token_expires_at). Raises InvalidToken when the provider
+    rejects the token.
+    """
+    cache_key = userinfo_cache_key(access_token)
+    ttl = USERINFO_CACHE_TTL
+    if expires_at:
+        ttl = min(ttl, int(expires_at - time.time()))
+    local_ttl = min(LOCAL_CACHE.ttl, ttl)
+
+    userinfo = LOCAL_CACHE.get(cache_key)
+    if userinfo is not None:
+        return userinfo
+    try:
+        cached = await redis_client.get(cache_key)
+    except Exception as e:
+        logging.error(f"Error reading cached userinfo: {e}")
+        cached = None
+    if cached is not None:
+        userinfo = json_loads(cached)
+        LOCAL_CACHE.set(cache_key, userinfo, ttl=local_ttl)
+        return userinfo
+
+    userinfo = await single_flight(cache_key, lambda: _request_userinfo(access_token))
+    if ttl > 0:
+        LOCAL_CACHE.set(cache_key, userinfo, ttl=local_ttl)
+        try:
+            await redis_client.set(cache_key, json_dumps(userinfo), ex=ttl)
+        except Exception as e:
+            logging.error(f"Error caching userinfo: {e}")
+    return userinfo
+
+
+async def evict_userinfo(access_token: str):
+    # From Redis and from every worker's local tier
+    await invalidate_cache(keys=[userinfo_cache_key(access_token)])
@@ -1,20 +1,84 @@
 # battery_pack_router.py
 
 import logging
-from fastapi import APIRouter, HTTPException, status
-from fastapi.responses import JSONResponse
-from app.battery_packs.list_battery_packs import get_battery_pack_data
-from .models import BatteryPackResponse
-import json
+from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from fastapi.responses import Response, StreamingResponse
+from app.db import PoolSaturated
+from app.battery_packs.list_battery_packs import (
+    get_cached_battery_pack_data,
+    open_battery_pack_stream,
+)
+from app.battery_packs.create_battery_pack import create_battery_packs
+from app.battery_packs.delete_battery_pack import decommission_battery_packs
+from app.battery_packs.get_battery_pack import get_battery_pack_item
+from app.battery_packs.update_battery_pack import update_battery_packs
+from app.battery_packs.watch_battery_packs import battery_pack_events
+from pydantic import conlist
+from .models import (
+    MAX_BULK_SIZE,
+    BatteryPackDecommission,
+    BatteryPackFilters,
+    BatteryPackResponse,
+    BatteryPackWrite,
+    BatteryPackWriteResponse,
+)
 
 router = APIRouter(prefix="/battery_packs")
 
+MAX_PAGE_SIZE = 1000
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+def battery_pack_filters(
+    status_label: Optional[str] = None,
+    company: Optional[str] = None,
+    location: Optional[str] = None,
+    battery_pack_state: Optional[str] = None,
+    soc_min: Optional[float] = None,
+    soc_max: Optional[float] = None,
+    soh_min: Optional[float] = None,
+    soh_max: Optional[float] = None,
+    after: Optional[str] = Query(None, description="asset_tag cursor from next_cursor"),
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+) -> BatteryPackFilters:
+    # Query parameters shared by every battery pack listing endpoint
+    return BatteryPackFilters(
+        status_label=status_label,
+        company=company,
+        location=location,
+        battery_pack_state=battery_pack_state,
+        soc_min=soc_min,
+        soc_max=soc_max,
+        soh_min=soh_min,
+        soh_max=soh_max,
+        after=after,
+        limit=limit,
+    )
+
 
 @router.get("/battery_packs", response_model=BatteryPackResponse)
-async def list_battery_packs():
+async def list_battery_packs(
+    request: Request,
+    filters: BatteryPackFilters = Depends(battery_pack_filters),
+    stream: bool = False,
+):
+    # Stream mode: every matching pack from the cursor on, one JSON per line
+    if stream or NDJSON_MEDIA_TYPE in request.headers.get("accept", ""):
+        # Connection and cursor are set up before the status goes out, so a
+        # saturated pool still gets its 503
+        try:
+            body = await open_battery_pack_stream(filters)
+        except PoolSaturated:
+            raise
+        except Exception as e:
+            logging.error(f"Error opening battery packs stream: {e}")
+            raise HTTPException(status_code=500, detail="Internal Server Error")
+        return StreamingResponse(body, media_type=NDJSON_MEDIA_TYPE)
+
     try:
         # Call the function to get the battery pack data
-        result = await get_battery_pack_data()  # Get data from the database
+        result = await get_cached_battery_pack_data(filters)  # Redis, then database
 
         # Ensure result has the correct status
         if result["status"] != "fetched":
@@ -22,39 +86,72 @@ async def list_battery_packs():
                 status_code=500, detail="Error fetching battery packs data"
             )
 
-        # Extract the result from the response
-        battery_packs = result["result"]
-
-        # Parse the 'structured_output' field if it exists
-        parsed_result = []
-        for item in battery_packs:
-            # Check if 'structured_output' exists
-            if "structured_output" in item:
-                try:
-                    # Ensure the structured_output is a valid JSON string and parse it
-                    structured_output = json.loads(item["structured_output"])
-                    item["structured_output"] = (
-                        structured_output  # Replace the string with the parsed object
-                    )
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error decoding JSON: {e}")
-                    item["structured_output"] = {}  # Set an empty dict if parsing fails
-            parsed_result.append(item)
-
-        # Return a response with status and result
-        return JSONResponse(
-            content={
-                "status": "fetched",  # You can change it to "success" if you prefer
-                "result": {"results": parsed_result},
-            }
-        )
+        # The body is the JSON document Postgres built; pass it through untouched
+        return Response(content=result["result"], media_type="application/json")
 
+    except PoolSaturated:
+        raise
     except Exception as e:
         # Log error if something goes wrong
         logging.error(f"Error fetching battery packs data: {e}")
         raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
+@router.post("/battery_packs", response_model=BatteryPackWriteResponse)
+async def create_battery_packs_bulk(
+    packs: conlist(BatteryPackWrite, min_items=1, max_items=MAX_BULK_SIZE)
+):
+    # One transaction for the whole batch; per-item outcome in input order
+    result = await create_battery_packs(packs)
+    if result["status"] != "created":
+        raise HTTPException(status_code=500, detail="Error creating battery packs")
+    return {"status": "created", "result": {"results": result["result"]}}
+
+
+@router.patch("/battery_packs", response_model=BatteryPackWriteResponse)
+async def update_battery_packs_bulk(
+    packs: conlist(BatteryPackWrite, min_items=1, max_items=MAX_BULK_SIZE)
+):
+    result = await update_battery_packs(packs)
+    if result["status"] != "updated":
+        raise HTTPException(status_code=500, detail="Error updating battery packs")
+    return {"status": "updated", "result": {"results": result["result"]}}
+
+
+@router.post("/decommission", response_model=BatteryPackWriteResponse)
+async def decommission_battery_packs_bulk(body: BatteryPackDecommission):
+    result = await decommission_battery_packs(body.asset_tags)
+    if result["status"] != "decommissioned":
+        raise HTTPException(
+            status_code=500, detail="Error decommissioning battery packs"
+        )
+    return {"status": "decommissioned", "result": {"results": result["result"]}}
+
+
+@router.get("/events")
+async def watch_battery_packs(asset_tag: Optional[List[str]] = Query(None)):
+    # Server-sent events with per-pack measurement deltas as they land, instead
+    # of re-polling the whole listing
+    return StreamingResponse(
+        battery_pack_events(set(asset_tag) if asset_tag else None),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# Registered last: the catch-all path must not shadow the routes above
+@router.get("/{asset_tag}")
+async def get_battery_pack(asset_tag: str):
+    result = await get_battery_pack_item(asset_tag)
+
+    if result["status"] == "not_found":
+        raise HTTPException(status_code=404, detail=result["message"])
+    if result["status"] != "fetched":
+        raise HTTPException(status_code=500, detail="Internal Server Error")
+
+    return Response(content=result["result"], media_type="application/json")
+
+
 # @router.get("/battery_packs", response_model=BatteryPackResponse)
 # async def list_battery_packs():
 #     try:
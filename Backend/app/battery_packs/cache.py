@@ -0,0 +1,104 @@
+# cache.py
+
+import logging
+from typing import Iterable, List, Optional
+
+from app.db import redis_client
+from app.local_cache import LOCAL_CACHE, invalidate_cache
+from app.utils import get_md5_hash
+
+from .models import BatteryPackFilters
+
+# Sorted set of the asset_tags matching one set of filters, for every filter
+# combination that has been listed
+INDEX_CACHE_PREFIX = "battery_packs:index:"
+# Each pack's rendered JSON, one key per asset_tag; listing pages and
+# single-pack lookups are both assembled from these
+ITEM_CACHE_PREFIX = "battery_packs:pack:"
+
+# Sets of the index keys currently cached, so they can be dropped without a
+# SCAN: every index, and those filtering on the latest state, SoC or SoH
+INDEX_REGISTRY = "battery_packs:indexes:all"
+MEASUREMENT_INDEX_REGISTRY = "battery_packs:indexes:measurements"
+
+# Values of the "reindex" field of a battery_pack_changes NOTIFY
+# (migrations/004_battery_pack_change_notifications.sql)
+REINDEX_REGISTRIES = {
+    "all": INDEX_REGISTRY,
+    "measurements": MEASUREMENT_INDEX_REGISTRY,
+}
+
+
+def battery_pack_index_cache_key(filters: BatteryPackFilters) -> str:
+    # The cursor and page size only pick a slice of the same index
+    filters = filters.copy(update={"after": None, "limit": None})
+    return f"{INDEX_CACHE_PREFIX}{get_md5_hash(filters.json())}"
+
+
+def battery_pack_index_registries(filters: BatteryPackFilters) -> List[str]:
+    # Registries an index is listed in, i.e. which changes can invalidate it
+    measured = (
+        filters.battery_pack_state,
+        filters.soc_min,
+        filters.soc_max,
+        filters.soh_min,
+        filters.soh_max,
+    )
+    if any(value is not None for value in measured):
+        return [INDEX_REGISTRY, MEASUREMENT_INDEX_REGISTRY]
+    return [INDEX_REGISTRY]
+
+
+def battery_pack_item_cache_key(asset_tag: str) -> str:
+    return f"{ITEM_CACHE_PREFIX}{asset_tag}"
+
+
+async def drop_battery_pack_indexes(registry: str = INDEX_REGISTRY):
+    # Indexes live in Redis only, so there is no local tier to tell
+    index_keys = await redis_client.smembers(registry)
+    if index_keys:
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(*index_keys)
+            pipe.srem(registry, *index_keys)
+            await pipe.execute()
+
+
+async def invalidate_battery_pack_cache(asset_tags: Optional[Iterable[str]] = None):
+    # For writes made through the API: the writer must see its change on its
+    # next read, so the given packs (all of them when the caller cannot tell)
+    # are dropped rather than marked stale, and with them every index
+    if asset_tags is None:
+        await invalidate_cache(prefixes=[ITEM_CACHE_PREFIX])
+    else:
+        await invalidate_cache(keys=[battery_pack_item_cache_key(tag) for tag in asset_tags])
+    try:
+        await drop_battery_pack_indexes()
+    except Exception as e:
+        logging.error(f"Error dropping battery pack indexes: {e}")
+
+
+def forget_local_battery_packs(asset_tags: Optional[Iterable[str]]):
+    # This worker's copies only; every worker gets the same NOTIFY and does
+    # the same, so nothing is broadcast
+    if asset_tags is None:
+        LOCAL_CACHE.delete_prefix(ITEM_CACHE_PREFIX)
+    else:
+        LOCAL_CACHE.delete(*[battery_pack_item_cache_key(tag) for tag in asset_tags])
+
+
+async def mark_battery_packs_stale(asset_tags: Optional[Iterable[str]], reindex: Optional[str]):
+    """Redis side of a change reported by Postgres.
+
+    The packs' documents stay cached but lose their :fresh marker, so the next
+    read serves them once and re-renders them in the background. Indexes are
+    only dropped when the change can move packs in or out of them. None for
+    asset_tags means every pack.
+    """
+    if asset_tags is None:
+        fresh_keys = [key async for key in redis_client.scan_iter(f"{ITEM_CACHE_PREFIX}*:fresh")]
+    else:
+        fresh_keys = [f"{battery_pack_item_cache_key(tag)}:fresh" for tag in asset_tags]
+    if fresh_keys:
+        await redis_client.delete(*fresh_keys)
+    if reindex is not None:
+        await drop_battery_pack_indexes(REINDEX_REGISTRIES.get(reindex, INDEX_REGISTRY))
@@ -0,0 +1,213 @@
+# create_battery_pack.py
+
+import logging
+from typing import Any, Dict, List
+
+import asyncpg
+
+from app.db import get_db_connection, release_db_connection
+
+from .cache import invalidate_battery_pack_cache
+from .models import BatteryPackWrite
+
+# Per-transaction staging table filled with COPY; the set-based statements in
+# this module and in update_battery_pack.py read from it
+STAGING_TABLE = "battery_pack_staging"
+
+STAGING_COLUMNS = [
+    "ord",
+    "asset_tag",
+    "status_label",
+    "company_name",
+    "location",
+    "warranty_months",
+    "battery_cell_chemistry",
+    "battery_cell_temperatures",
+    "battery_cell_type",
+    "battery_cell_voltages",
+    "battery_pack_casing",
+    "battery_pack_nominal_charge_capacity",
+    "battery_pack_nominal_voltage",
+    "bms_type",
+]
+
+CREATE_STAGING_TABLE = f"""
+CREATE TEMP TABLE {STAGING_TABLE} (
+  ord int NOT NULL,
+  asset_tag text NOT NULL,
+  status_label text,
+  company_name text,
+  location text,
+  warranty_months int,
+  battery_cell_chemistry text,
+  battery_cell_temperatures text,
+  battery_cell_type text,
+  battery_cell_voltages text,
+  battery_pack_casing text,
+  battery_pack_nominal_charge_capacity text,
+  battery_pack_nominal_voltage text,
+  bms_type text
+) ON COMMIT DROP
+"""
+
+# Resolves names to ids once per batch and flags rows that cannot be written.
+# {existence_error} decides whether an existing or a missing asset is the error;
+# {found_condition} narrows which assets count as existing.
+RESOLVED_STAGING_CTE = f"""
+staged AS (
+  SELECT
+    s.*,
+    (SELECT sl.id FROM "snipe-it".status_labels sl WHERE sl.name = s.status_label ORDER BY sl.id LIMIT 1) AS status_id,
+    (SELECT c.id FROM "snipe-it".companies c WHERE c.name = s.company_name ORDER BY c.id LIMIT 1) AS company_id,
+    (SELECT l.id FROM "snipe-it".locations l WHERE l.name = s.location ORDER BY l.id LIMIT 1) AS location_id,
+    EXISTS (
+      SELECT 1 FROM "snipe-it".assets a
+      WHERE a.asset_tag = s.asset_tag AND a.deleted_at IS NULL {{found_condition}}
+    ) AS found,
+    row_number() OVER (PARTITION BY s.asset_tag ORDER BY s.ord) AS occurrence
+  FROM {STAGING_TABLE} s
+),
+checked AS (
+  SELECT
+    st.*,
+    CASE
+      WHEN st.occurrence > 1 THEN 'duplicate asset_tag in request'
+      {{existence_error}}
+      WHEN st.status_label IS NOT NULL AND st.status_id IS NULL THEN 'unknown status_label'
+      WHEN st.company_name IS NOT NULL AND st.company_id IS NULL THEN 'unknown company_name'
+      WHEN st.location IS NOT NULL AND st.location_id IS NULL THEN 'unknown location'
+    END AS error
+  FROM staged st
+)
+"""
+
+# Asset tags are unique across every Snipe-IT asset, not just battery packs
+CREATE_BATTERY_PACKS_QUERY = f"""
+WITH {RESOLVED_STAGING_CTE.format(
+    existence_error="WHEN st.found THEN 'asset_tag already exists'",
+    found_condition="",
+)},
+written AS (
+  INSERT INTO "snipe-it".assets (
+    asset_tag,
+    model_id,
+    status_id,
+    company_id,
+    location_id,
+    warranty_months,
+    _snipeit_battery_cell_chemistry_18,
+    _snipeit_battery_cell_temperatures_54,
+    _snipeit_battery_cell_type_24,
+    _snipeit_battery_cell_voltages_53,
+    _snipeit_battery_pack_casing_25,
+    _snipeit_battery_pack_nominal_charge_capacity_22,
+    _snipeit_battery_pack_nominal_voltage_21,
+    _snipeit_bms_type_23,
+    created_at,
+    updated_at
+  )
+  SELECT
+    c.asset_tag,
+    7,
+    c.status_id,
+    c.company_id,
+    c.location_id,
+    c.warranty_months,
+    c.battery_cell_chemistry,
+    c.battery_cell_temperatures,
+    c.battery_cell_type,
+    c.battery_cell_voltages,
+    c.battery_pack_casing,
+    c.battery_pack_nominal_charge_capacity,
+    c.battery_pack_nominal_voltage,
+    c.bms_type,
+    now(),
+    now()
+  FROM checked c
+  WHERE c.error IS NULL
+  RETURNING asset_tag
+)
+SELECT c.asset_tag, c.error
+FROM checked c
+ORDER BY c.ord
+"""
+
+
+def staging_records(packs: List[BatteryPackWrite]) -> List[tuple]:
+    # Tuples in STAGING_COLUMNS order, as copy_records_to_table expects
+    records = []
+    for ord, pack in enumerate(packs):
+        attrs = pack.battery_pack
+        records.append(
+            (
+                ord,
+                pack.asset_tag,
+                pack.status_label,
+                pack.company_name,
+                pack.location,
+                pack.warranty_duration,
+                attrs.battery_cell_chemistry,
+                attrs.battery_cell_temperatures,
+                attrs.battery_cell_type,
+                attrs.battery_cell_voltages,
+                attrs.battery_pack_casing,
+                _as_text(attrs.battery_pack_nominal_charge_capacity),
+                _as_text(attrs.battery_pack_nominal_voltage),
+                attrs.bms_type,
+            )
+        )
+    return records
+
+
+def _as_text(value):
+    # snipe-it custom fields are text columns; keep "48", not "48.0"
+    if value is None:
+        return None
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+async def write_battery_packs(
+    conn: asyncpg.Connection, packs: List[BatteryPackWrite], query: str, done: str
+) -> List[Dict[str, Any]]:
+    """Stage packs with COPY and apply them with one set-based statement.
+
+    Must run inside a transaction (the staging table is dropped on commit).
+    Returns one {asset_tag, status, message} per input pack, in input order.
+    """
+    await conn.execute(CREATE_STAGING_TABLE)
+    await conn.copy_records_to_table(
+        STAGING_TABLE, records=staging_records(packs), columns=STAGING_COLUMNS
+    )
+    rows = await conn.fetch(query)
+    return [
+        {
+            "asset_tag": row["asset_tag"],
+            "status": done if row["error"] is None else "error",
+            "message": row["error"],
+        }
+        for row in rows
+    ]
+
+
+async def create_battery_packs(packs: List[BatteryPackWrite]) -> Dict[str, Any]:
+    conn = await get_db_connection()
+    try:
+        async with conn.transaction():
+            # asset_tag has no unique constraint in snipe-it; serialise bulk
+            # creates so two batches cannot insert the same tag
+            await conn.execute(
+                "SELECT pg_advisory_xact_lock(hashtext('battery_packs:create'))"
+            )
+            results = await write_battery_packs(
+                conn, packs, CREATE_BATTERY_PACKS_QUERY, done="created"
+            )
+    except Exception as e:
+        logging.error(f"Error creating battery packs: {str(e)}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        await release_db_connection(conn)
+
+    await invalidate_battery_pack_cache(
+        [r["asset_tag"] for r in results if r["status"] == "created"]
+    )
+    return {"status": "created", "result": results}
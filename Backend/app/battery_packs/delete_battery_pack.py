@@ -0,0 +1,71 @@
+# delete_battery_pack.py
+
+import logging
+from typing import Any, Dict, List
+
+from app.db import get_db_connection, release_db_connection
+
+from .cache import invalidate_battery_pack_cache
+
+# Soft delete, as snipe-it itself does; the listing skips deleted assets
+DECOMMISSION_ASSETS_QUERY = """
+UPDATE "snipe-it".assets
+SET deleted_at = now(), updated_at = now()
+WHERE asset_tag = ANY($1::text[])
+  AND model_id = 7
+  AND deleted_at IS NULL
+RETURNING asset_tag
+"""
+
+# Drop the packs from every tracker's `battery_pack` attribute; the triggers
+# from migrations/002_battery_pack_trackers.sql then refresh the mapping.
+# Only exact matches go: elements without an asset_tag (or that are not
+# objects) compare as NULL and must be kept, the attributes are free-form.
+UNLINK_TRACKERS_QUERY = """
+UPDATE traccar.tc_devices td
+SET attributes = jsonb_set(
+  td.attributes::jsonb,
+  '{battery_pack}',
+  (
+    SELECT COALESCE(jsonb_agg(bp), '[]'::jsonb)
+    FROM jsonb_array_elements(td.attributes::jsonb->'battery_pack') AS bp
+    WHERE (bp->>'asset_tag' = ANY($1::text[])) IS NOT TRUE
+  )
+)::text
+WHERE td.id IN (
+  SELECT bt.device_id
+  FROM traccar.battery_pack_trackers bt
+  WHERE bt.asset_tag = ANY($1::text[])
+)
+"""
+
+
+async def decommission_battery_packs(asset_tags: List[str]) -> Dict[str, Any]:
+    # One statement per table, one transaction for the whole batch
+    conn = await get_db_connection()
+    try:
+        async with conn.transaction():
+            rows = await conn.fetch(DECOMMISSION_ASSETS_QUERY, asset_tags)
+            # Only packs this call actually decommissioned; unknown or already
+            # deleted ones are reported as not_found and left untouched
+            decommissioned = [row["asset_tag"] for row in rows]
+            if decommissioned:
+                await conn.execute(UNLINK_TRACKERS_QUERY, decommissioned)
+    except Exception as e:
+        logging.error(f"Error decommissioning battery packs: {str(e)}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        await release_db_connection(conn)
+
+    await invalidate_battery_pack_cache(decommissioned)
+    decommissioned = set(decommissioned)
+    return {
+        "status": "decommissioned",
+        "result": [
+            {
+                "asset_tag": tag,
+                "status": "decommissioned" if tag in decommissioned else "not_found",
+            }
+            for tag in dict.fromkeys(asset_tags)
+        ],
+    }
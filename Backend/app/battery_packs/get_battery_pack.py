@@ -0,0 +1,81 @@
+# get_battery_pack.py
+
+import logging
+from typing import Any, Dict
+
+from app.db import (
+    PoolSaturated,
+    get_db_connection,
+    register_prepared_query,
+    release_db_connection,
+)
+from app.redis_func import fetch_stale_while_revalidate
+from app.singleflight import single_flight, single_flight_key
+
+from .cache import battery_pack_item_cache_key
+from .list_battery_packs import (
+    BATTERY_PACK_CACHE_HARD_TTL,
+    BATTERY_PACK_CACHE_SOFT_TTL,
+    BATTERY_PACK_QUERY_TEMPLATE,
+)
+
+# Same document as a listing row, looked up by asset_tag through the
+# (model_id, asset_tag) index, the tracker mapping and the latest-state table.
+# Prepared on every pooled connection, see app.db.register_prepared_query.
+_BATTERY_PACK_ROW_QUERY = BATTERY_PACK_QUERY_TEMPLATE.format(
+    asset_condition="a.asset_tag = $1",
+    details_condition="",
+    pack_condition="LIMIT 1",
+)
+
+# Bare pack JSON: it is cached under the same key listing pages read from
+BATTERY_PACK_ITEM_QUERY = f"""
+SELECT item.result::text AS result
+FROM ({_BATTERY_PACK_ROW_QUERY}) item
+"""
+
+
+register_prepared_query("battery_pack_item", BATTERY_PACK_ITEM_QUERY)
+
+
+class BatteryPackNotFound(LookupError):
+    pass
+
+
+async def fetch_battery_pack_item(asset_tag: str) -> str:
+    # Cached, so read from the primary: see get_read_db_connection
+    conn = await get_db_connection()
+    try:
+        statement = await conn.prepared("battery_pack_item")
+        body = await statement.fetchval(asset_tag)
+    finally:
+        await release_db_connection(conn)
+    if body is None:
+        raise BatteryPackNotFound(asset_tag)
+    return body
+
+
+async def get_battery_pack_item(asset_tag: str) -> Dict[str, Any]:
+    # Unknown packs are not cached, so a pack created later shows up at once
+    async def compute() -> str:
+        return await single_flight(
+            single_flight_key(BATTERY_PACK_ITEM_QUERY, asset_tag),
+            lambda: fetch_battery_pack_item(asset_tag),
+        )
+
+    try:
+        document = await fetch_stale_while_revalidate(
+            battery_pack_item_cache_key(asset_tag),
+            compute,
+            soft_ttl=BATTERY_PACK_CACHE_SOFT_TTL,
+            hard_ttl=BATTERY_PACK_CACHE_HARD_TTL,
+        )
+        body = f'{{"status": "fetched", "result": {document}}}'
+        return {"status": "fetched", "result": body}
+    except PoolSaturated:
+        raise
+    except BatteryPackNotFound:
+        return {"status": "not_found", "message": f"Battery pack {asset_tag} not found"}
+    except Exception as e:
+        logging.error(f"Error fetching battery pack {asset_tag}: {str(e)}")
+        return {"status": "error", "message": str(e)}
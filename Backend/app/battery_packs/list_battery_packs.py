@@ -1,11 +1,57 @@
 # list_battery_packs.py
 
+import asyncio
+import bisect
 import logging
-from app.db import get_db_connection, release_db_connection
-from typing import List, Dict, Any
-import json
+import os
+import secrets
+from app.db import (
+    PoolSaturated,
+    get_db_connection,
+    get_read_db_connection,
+    redis_client,
+    register_prepared_query,
+    release_db_connection,
+)
+from app.local_cache import LOCAL_CACHE
+from app.redis_func import refresh_stale_entries, release_lock, store_cache_entries
+from app.singleflight import single_flight, single_flight_key
+from app.utils import json_dumps
+from redis.exceptions import RedisError
+from typing import AsyncIterator, List, Dict, Any, Optional
+
+from .cache import (
+    ITEM_CACHE_PREFIX,
+    battery_pack_index_cache_key,
+    battery_pack_index_registries,
+    battery_pack_item_cache_key,
+)
+from .models import BatteryPackFilters
+
+# Rendered packs are served from Redis; after the soft TTL a single-pack
+# lookup returns the stale copy while one worker recomputes it, after the hard
+# TTL it is dropped. Changes are pushed out by app.notify, so both can be
+# generous.
+BATTERY_PACK_CACHE_SOFT_TTL = int(os.getenv("BATTERY_PACK_CACHE_SOFT_TTL", "300"))
+BATTERY_PACK_CACHE_HARD_TTL = int(os.getenv("BATTERY_PACK_CACHE_HARD_TTL", "3600"))
+# Lifetime of a per-filter asset_tag index; changes that can affect it drop it
+BATTERY_PACK_INDEX_TTL = int(os.getenv("BATTERY_PACK_INDEX_TTL", "300"))
+
+# Member scored like every asset_tag but sorting before all of them, so an
+# index with no matching packs still exists; never returned by the lex ranges
+INDEX_SENTINEL = ""
 
-BATTERY_PACK_QUERY = """
+# How long other workers wait for the worker rebuilding a missing index before
+# building it themselves, and how often they look for it meanwhile
+BATTERY_PACK_INDEX_BUILD_TIMEOUT = int(os.getenv("BATTERY_PACK_INDEX_BUILD_TIMEOUT", "10"))
+INDEX_BUILD_POLL_INTERVAL = 0.05
+
+# Rows pulled per round trip by the server-side cursor in stream mode
+STREAM_PREFETCH = 200
+
+# One JSON document per pack. The {placeholders} are filled in below for the
+# paginated listing and in get_battery_pack.py for the single-pack lookup.
+BATTERY_PACK_QUERY_TEMPLATE = """
 WITH battery_assets AS (
   SELECT
     a.asset_tag,
@@ -24,6 +70,8 @@ WITH battery_assets AS (
     a._snipeit_bms_type_23 AS bms_type
   FROM "snipe-it".assets a
   WHERE a.model_id = 7
+    AND a.deleted_at IS NULL
+    AND {asset_condition}
 ),
 asset_details AS (
   SELECT
@@ -37,36 +85,9 @@ asset_details AS (
   LEFT JOIN "snipe-it".status_labels sl ON ba.status_id = sl.id
   LEFT JOIN "snipe-it".companies c ON ba.company_id = c.id
   LEFT JOIN "snipe-it".locations l ON ba.location_id = l.id
-),
-matched_tracker AS (
-  SELECT
-    ad.asset_tag,
-    td.uniqueid AS position_tracker_id,
-    td.attributes
-  FROM asset_details ad
-  LEFT JOIN traccar.tc_devices td ON EXISTS (
-    SELECT 1
-    FROM jsonb_array_elements(CAST(td.attributes AS jsonb)->'battery_pack') AS bp
-    WHERE bp->>'asset_tag' = ad.asset_tag
-  )
-),
-latest_measurements AS (
-  SELECT DISTINCT ON (sm.master_identifier)
-    sm.master_identifier,
-    sm.master_battery_pack_voltage,
-    sm.master_battery_pack_current,
-    sm."SoC",
-    sm."SoH",
-    sm.battery_pack_state,
-    sm."RCC",
-    sm."SoCS",
-    sm."SoDS",
-    sm."CoC",
-    sm.timestamp AS electrical_data_updatedAt
-  FROM goodenough.battery_pack__standard_measurements sm
-  ORDER BY sm.master_identifier, sm.timestamp DESC
+  {details_condition}
 )
-SELECT jsonb_pretty(jsonb_build_object(
+SELECT ad.asset_tag, jsonb_build_object(
   'asset_tag', ad.asset_tag,
   'status_label', ad.status_label,
   'model', ad.model,
@@ -85,7 +106,7 @@ SELECT jsonb_pretty(jsonb_build_object(
     'bms_manufacturer_name', 'Jiabaida',
     'bms_type', COALESCE(ad.bms_type, ''),
     'CoC', COALESCE(lm."CoC", 0),
-    'electrical_data_updatedAt', COALESCE(to_char(lm.electrical_data_updatedAt, 'YYYY-MM-DD"T"HH24:MI:SS+00:00'), ''),
+    'electrical_data_updatedAt', COALESCE(to_char(lm."timestamp", 'YYYY-MM-DD"T"HH24:MI:SS+00:00'), ''),
     'master_battery_pack_current', COALESCE(lm.master_battery_pack_current, 0),
     'master_battery_pack_voltage', COALESCE(lm.master_battery_pack_voltage, 0),
     'RCC', COALESCE(lm."RCC", 0),
@@ -99,123 +120,359 @@ SELECT jsonb_pretty(jsonb_build_object(
     'position_tracker', CASE WHEN mt.position_tracker_id IS NOT NULL
                              THEN jsonb_build_array(jsonb_build_object('asset_tag', mt.position_tracker_id))
                              ELSE '[]'::jsonb END,
-    'sim_card', CASE WHEN mt.attributes::jsonb ? 'SIM_card'
-                     THEN jsonb_build_array(jsonb_build_object('asset_tag', mt.attributes::jsonb->>'SIM_card'))
+    'sim_card', CASE WHEN mt.sim_card IS NOT NULL
+                     THEN jsonb_build_array(jsonb_build_object('asset_tag', mt.sim_card))
                      ELSE '[]'::jsonb END,
-    'vehicle', CASE WHEN mt.attributes::jsonb ? 'vehicle'
-                    THEN jsonb_build_array(jsonb_build_object('asset_tag', mt.attributes::jsonb->>'vehicle'))
+    'vehicle', CASE WHEN mt.vehicle IS NOT NULL
+                    THEN jsonb_build_array(jsonb_build_object('asset_tag', mt.vehicle))
                     ELSE '[]'::jsonb END
   )
-)) AS result
+) AS result
 FROM asset_details ad
-LEFT JOIN matched_tracker mt ON ad.asset_tag = mt.asset_tag
-LEFT JOIN latest_measurements lm ON lm.master_identifier = CAST(mt.position_tracker_id AS int8);
+-- Maintained by the triggers in migrations/002_battery_pack_trackers.sql.
+-- One tracker per pack keeps asset_tag unique, which keyset paging relies on.
+LEFT JOIN LATERAL (
+  SELECT bt.position_tracker_id, bt.sim_card, bt.vehicle
+  FROM traccar.battery_pack_trackers bt
+  WHERE bt.asset_tag = ad.asset_tag
+  ORDER BY bt.device_id
+  LIMIT 1
+) mt ON true
+-- Maintained by the trigger in migrations/001_battery_pack_latest_measurements.sql
+LEFT JOIN goodenough.battery_pack__latest_measurements lm ON lm.master_identifier = CAST(mt.position_tracker_id AS int8)
+{pack_condition}
 """
 
+# Keyset order is byte order (COLLATE "C"), the order Redis sorts index
+# members in and Python compares str in, so the cursor means the same thing to
+# the database, the cached indexes and bisect. Served by the index in
+# migrations/006_battery_pack_asset_tag_byte_order.sql.
+BATTERY_PACK_QUERY = BATTERY_PACK_QUERY_TEMPLATE.format(
+    asset_condition='($1::text IS NULL OR a.asset_tag COLLATE "C" > $1)',
+    details_condition="""WHERE ($2::text IS NULL OR sl.name = $2)
+    AND ($3::text IS NULL OR c.name = $3)
+    AND ($4::text IS NULL OR l.name = $4)""",
+    pack_condition="""WHERE ($5::text IS NULL OR lm.battery_pack_state = $5)
+  AND ($6::float8 IS NULL OR lm."SoC" >= $6)
+  AND ($7::float8 IS NULL OR lm."SoC" <= $7)
+  AND ($8::float8 IS NULL OR lm."SoH" >= $8)
+  AND ($9::float8 IS NULL OR lm."SoH" <= $9)
+ORDER BY ad.asset_tag COLLATE "C"
+LIMIT $10""",
+)
 
-async def get_battery_pack_data() -> Dict[str, Any]:
-    conn = await get_db_connection()
+# The whole page, envelope included, as one compact JSON document built by
+# Postgres. The endpoint returns this text as-is; nothing is decoded in Python.
+BATTERY_PACK_PAGE_QUERY = f"""
+SELECT jsonb_build_object(
+  'status', 'fetched',
+  'result', jsonb_build_object(
+    'results', COALESCE(jsonb_agg(page.result ORDER BY page.asset_tag COLLATE "C"), '[]'::jsonb),
+    'next_cursor', CASE WHEN count(*) = $10 THEN max(page.asset_tag COLLATE "C") END
+  )
+)::text AS body
+FROM ({BATTERY_PACK_QUERY}) page
+"""
+
+
+# Stream mode hands each row's JSON straight to the client, so it is kept as
+# text rather than decoded by the pool's jsonb codec
+BATTERY_PACK_STREAM_QUERY = f"""
+SELECT page.result::text AS result
+FROM ({BATTERY_PACK_QUERY}) page
+ORDER BY page.asset_tag COLLATE "C"
+"""
+
+# Every asset_tag matching the filters, in listing order (run without cursor
+# or LIMIT). Postgres drops the unused JSON column from the subquery.
+BATTERY_PACK_INDEX_QUERY = f"""
+SELECT COALESCE(array_agg(page.asset_tag ORDER BY page.asset_tag COLLATE "C"), '{{}}')
+FROM ({BATTERY_PACK_QUERY}) page
+"""
+
+_BATTERY_PACK_DOCUMENT_ROWS_QUERY = BATTERY_PACK_QUERY_TEMPLATE.format(
+    asset_condition="a.asset_tag = ANY($1::text[])",
+    details_condition="",
+    pack_condition="",
+)
+
+# Rendered JSON for a batch of packs missing from the cache
+BATTERY_PACK_DOCUMENTS_QUERY = f"""
+SELECT page.asset_tag, page.result::text AS result
+FROM ({_BATTERY_PACK_DOCUMENT_ROWS_QUERY}) page
+"""
+
+register_prepared_query("battery_pack_page", BATTERY_PACK_PAGE_QUERY)
+register_prepared_query("battery_pack_stream", BATTERY_PACK_STREAM_QUERY)
+register_prepared_query("battery_pack_index", BATTERY_PACK_INDEX_QUERY)
+register_prepared_query("battery_pack_documents", BATTERY_PACK_DOCUMENTS_QUERY)
+
+
+def battery_pack_query_args(filters: BatteryPackFilters) -> List[Any]:
+    # Positional arguments for BATTERY_PACK_QUERY, in placeholder order
+    return [
+        filters.after,
+        filters.status_label,
+        filters.company,
+        filters.location,
+        filters.battery_pack_state,
+        filters.soc_min,
+        filters.soc_max,
+        filters.soh_min,
+        filters.soh_max,
+        filters.limit,
+    ]
+
+
+async def fetch_battery_pack_page(args: List[Any]) -> str:
+    conn = await get_read_db_connection()
+    try:
+        statement = await conn.prepared("battery_pack_page")
+        return await statement.fetchval(*args)
+    finally:
+        await release_db_connection(conn)
+
+
+async def get_battery_pack_data(filters: BatteryPackFilters) -> Dict[str, Any]:
+    args = battery_pack_query_args(filters)
     try:
-        result = await conn.fetch(BATTERY_PACK_QUERY)
-
-        # Debug: Log the actual result to inspect its structure
-        logging.debug(f"Query result: {result}")
-
-        # Check if the result is in the expected format
-        if result:
-            # Parse the JSON string in the 'result' field
-            parsed_result = []
-            for record in result:
-                # Load the JSON string into a dictionary
-                try:
-                    # Parse the result from JSON string to dictionary
-                    record_data = json.loads(record["result"])
-
-                    # Build the final structure
-                    structured_result = {
-                        "asset_tag": record_data["asset_tag"],
-                        "status_label": record_data["status_label"],
-                        "model": record_data["model"],
-                        "company_name": record_data["company_name"],
-                        "warranty_duration": record_data["warranty_duration"],
-                        "location": record_data["location"],
-                        "battery_pack": {
-                            "battery_cell_chemistry": record_data["battery_pack"][
-                                "battery_cell_chemistry"
-                            ],
-                            "battery_cell_temperatures": record_data["battery_pack"][
-                                "battery_cell_temperatures"
-                            ],
-                            "battery_cell_type": record_data["battery_pack"][
-                                "battery_cell_type"
-                            ],
-                            "battery_cell_voltages": record_data["battery_pack"][
-                                "battery_cell_voltages"
-                            ],
-                            "battery_pack_casing": record_data["battery_pack"][
-                                "battery_pack_casing"
-                            ],
-                            "battery_pack_nominal_charge_capacity": record_data[
-                                "battery_pack"
-                            ]["battery_pack_nominal_charge_capacity"],
-                            "battery_pack_nominal_voltage": record_data["battery_pack"][
-                                "battery_pack_nominal_voltage"
-                            ],
-                            "battery_pack_state": record_data["battery_pack"][
-                                "battery_pack_state"
-                            ],
-                            "bms_manufacturer_name": record_data["battery_pack"][
-                                "bms_manufacturer_name"
-                            ],
-                            "bms_type": record_data["battery_pack"]["bms_type"],
-                            "CoC": record_data["battery_pack"]["CoC"],
-                            "electrical_data_updatedAt": record_data["battery_pack"][
-                                "electrical_data_updatedAt"
-                            ],
-                            "master_battery_pack_current": record_data["battery_pack"][
-                                "master_battery_pack_current"
-                            ],
-                            "master_battery_pack_voltage": record_data["battery_pack"][
-                                "master_battery_pack_voltage"
-                            ],
-                            "RCC": record_data["battery_pack"]["RCC"],
-                            "SoC": record_data["battery_pack"]["SoC"],
-                            "SoCS": record_data["battery_pack"]["SoCS"],
-                            "SoDS": record_data["battery_pack"]["SoDS"],
-                            "SoH": record_data["battery_pack"]["SoH"],
-                        },
-                        "set": {
-                            "battery_pack": [{"asset_tag": record_data["asset_tag"]}],
-                            "position_tracker": (
-                                [{"asset_tag": record_data["asset_tag"]}]
-                                if "position_tracker" in record_data
-                                else []
-                            ),
-                            "sim_card": (
-                                [{"asset_tag": record_data["asset_tag"]}]
-                                if "sim_card" in record_data
-                                else []
-                            ),
-                            "vehicle": (
-                                [{"asset_tag": record_data["asset_tag"]}]
-                                if "vehicle" in record_data
-                                else []
-                            ),
-                        },
-                    }
-
-                    parsed_result.append(structured_result)
-                except json.JSONDecodeError as e:
-                    logging.error(f"Error parsing JSON: {e}")
-                    return {"status": "error", "message": f"Error parsing JSON: {e}"}
-
-            return {"status": "fetched", "result": parsed_result}
-        else:
-            return {"status": "error", "message": "No data fetched from the database"}
+        # Concurrent identical requests in this worker share one query
+        body = await single_flight(
+            single_flight_key(BATTERY_PACK_PAGE_QUERY, *args),
+            lambda: fetch_battery_pack_page(args),
+        )
+        return {"status": "fetched", "result": body}
+    except PoolSaturated:
+        raise
     except Exception as e:
         logging.error(f"Error fetching battery packs data: {str(e)}")
         return {"status": "error", "message": str(e)}
+
+
+async def fetch_battery_pack_index(filters: BatteryPackFilters) -> List[str]:
+    # Indexes and documents are written to the cache, so they are read from
+    # the primary; only uncached reads go to the replicas
+    args = battery_pack_query_args(filters.copy(update={"after": None, "limit": None}))
+    conn = await get_db_connection()
+    try:
+        statement = await conn.prepared("battery_pack_index")
+        return await statement.fetchval(*args)
+    finally:
+        await release_db_connection(conn)
+
+
+async def fetch_battery_pack_documents(asset_tags: List[str]) -> Dict[str, str]:
+    conn = await get_db_connection()
+    try:
+        statement = await conn.prepared("battery_pack_documents")
+        records = await statement.fetch(asset_tags)
+        return {record["asset_tag"]: record["result"] for record in records}
+    finally:
+        await release_db_connection(conn)
+
+
+async def _read_index_page(filters: BatteryPackFilters) -> Optional[List[str]]:
+    # The page straight from the sorted set; None when there is no index yet
+    index_key = battery_pack_index_cache_key(filters)
+    async with redis_client.pipeline(transaction=False) as pipe:
+        pipe.exists(index_key)
+        pipe.zrangebylex(
+            index_key, f"({filters.after or INDEX_SENTINEL}", "+", start=0, num=filters.limit
+        )
+        exists, asset_tags = await pipe.execute()
+    return asset_tags if exists else None
+
+
+async def _build_index(filters: BatteryPackFilters) -> List[str]:
+    asset_tags = await fetch_battery_pack_index(filters)
+    index_key = battery_pack_index_cache_key(filters)
+    try:
+        # MULTI, so readers never see a half-written index; registered so an
+        # invalidation can find it without a SCAN
+        async with redis_client.pipeline(transaction=True) as pipe:
+            pipe.delete(index_key)
+            pipe.zadd(index_key, dict.fromkeys([INDEX_SENTINEL, *asset_tags], 0))
+            pipe.expire(index_key, BATTERY_PACK_INDEX_TTL)
+            for registry in battery_pack_index_registries(filters):
+                pipe.sadd(registry, index_key)
+                pipe.expire(registry, BATTERY_PACK_INDEX_TTL)
+            await pipe.execute()
+    except Exception as e:
+        logging.error(f"Error caching battery pack index {index_key}: {e}")
+    return asset_tags
+
+
+async def _build_index_once(filters: BatteryPackFilters) -> Optional[List[str]]:
+    # One rebuild per index across all workers: the worker that takes the
+    # build lock queries Postgres; the others wait for its index to appear and
+    # return None, or build it themselves if it does not show up in time
+    index_key = battery_pack_index_cache_key(filters)
+    lock_key = f"{index_key}:building"
+    owner = secrets.token_hex(16)
+    if await redis_client.set(lock_key, owner, nx=True, ex=BATTERY_PACK_INDEX_BUILD_TIMEOUT):
+        try:
+            return await _build_index(filters)
+        finally:
+            await release_lock(lock_key, owner)
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + BATTERY_PACK_INDEX_BUILD_TIMEOUT
+    while loop.time() < deadline:
+        await asyncio.sleep(INDEX_BUILD_POLL_INTERVAL)
+        async with redis_client.pipeline(transaction=False) as pipe:
+            pipe.exists(index_key)
+            pipe.exists(lock_key)
+            built, building = await pipe.execute()
+        if built:
+            return None
+        if not building:
+            break
+    logging.warning(f"Index {index_key} was not rebuilt in time, building it here")
+    return await _build_index(filters)
+
+
+async def _index_page(filters: BatteryPackFilters) -> List[str]:
+    asset_tags = await _read_index_page(filters)
+    if asset_tags is not None:
+        return asset_tags
+    index = await single_flight(
+        single_flight_key(BATTERY_PACK_INDEX_QUERY, battery_pack_index_cache_key(filters)),
+        lambda: _build_index_once(filters),
+    )
+    if index is None:
+        # Built by another worker
+        asset_tags = await _read_index_page(filters)
+        if asset_tags is not None:
+            return asset_tags
+        index = await _build_index(filters)
+    start = bisect.bisect_right(index, filters.after) if filters.after else 0
+    return index[start : start + filters.limit]
+
+
+async def _refresh_documents(cache_keys: List[str]) -> Dict[str, str]:
+    # compute() for refresh_stale_entries: item keys in, item keys out
+    asset_tags = [key[len(ITEM_CACHE_PREFIX) :] for key in cache_keys]
+    fetched = await fetch_battery_pack_documents(asset_tags)
+    return {battery_pack_item_cache_key(tag): value for tag, value in fetched.items()}
+
+
+async def get_battery_pack_documents(asset_tags: List[str]) -> List[str]:
+    """Rendered JSON of the given packs, in order; unknown packs are left out.
+
+    Looks in this worker's LOCAL_CACHE, then fetches the rest, with their
+    freshness markers, in one MGET. Stale packs are served as they are and
+    re-rendered in the background, as in fetch_stale_while_revalidate; only
+    packs missing from both tiers are rendered by Postgres inline, in one
+    batched query, and written back.
+    """
+    documents = {tag: LOCAL_CACHE.get(battery_pack_item_cache_key(tag)) for tag in asset_tags}
+    local_ttl = min(LOCAL_CACHE.ttl, BATTERY_PACK_CACHE_SOFT_TTL)
+
+    remote = [battery_pack_item_cache_key(tag) for tag, doc in documents.items() if doc is None]
+    if remote:
+        values = await redis_client.mget(remote + [f"{key}:fresh" for key in remote])
+        stale = []
+        for key, value, fresh in zip(remote, values, values[len(remote) :]):
+            if value is None:
+                continue
+            documents[key[len(ITEM_CACHE_PREFIX) :]] = value
+            if fresh is None:
+                stale.append(key)
+            else:
+                LOCAL_CACHE.set(key, value, ttl=local_ttl)
+        if stale:
+            await refresh_stale_entries(
+                stale,
+                _refresh_documents,
+                soft_ttl=BATTERY_PACK_CACHE_SOFT_TTL,
+                hard_ttl=BATTERY_PACK_CACHE_HARD_TTL,
+            )
+
+    missing = [tag for tag, document in documents.items() if document is None]
+    if missing:
+        logging.debug(f"❌ Rendering {len(missing)} uncached battery packs")
+        fetched = await single_flight(
+            single_flight_key(BATTERY_PACK_DOCUMENTS_QUERY, missing),
+            lambda: fetch_battery_pack_documents(missing),
+        )
+        documents.update(fetched)
+        await store_cache_entries(
+            {battery_pack_item_cache_key(tag): value for tag, value in fetched.items()},
+            soft_ttl=BATTERY_PACK_CACHE_SOFT_TTL,
+            hard_ttl=BATTERY_PACK_CACHE_HARD_TTL,
+        )
+        for tag, value in fetched.items():
+            LOCAL_CACHE.set(battery_pack_item_cache_key(tag), value, ttl=local_ttl)
+
+    return [documents[tag] for tag in asset_tags if documents[tag] is not None]
+
+
+async def get_cached_battery_pack_data(filters: BatteryPackFilters) -> Dict[str, Any]:
+    # A page is the filter's cached asset_tag index sliced at the cursor, plus
+    # each pack's own cached JSON; a changed pack only invalidates itself
+    try:
+        try:
+            asset_tags = await _index_page(filters)
+            documents = await get_battery_pack_documents(asset_tags)
+        except RedisError as e:
+            logging.error(f"Redis unavailable, listing from the database: {str(e)}")
+            return await get_battery_pack_data(filters)
+
+        next_cursor = asset_tags[-1] if len(asset_tags) == filters.limit else None
+        # Same envelope BATTERY_PACK_PAGE_QUERY builds, joined without decoding
+        body = (
+            '{"status": "fetched", "result": {"results": ['
+            + ", ".join(documents)
+            + '], "next_cursor": '
+            + json_dumps(next_cursor).decode("utf-8")
+            + "}}"
+        )
+        return {"status": "fetched", "result": body}
+    except PoolSaturated:
+        raise
+    except Exception as e:
+        logging.error(f"Error fetching cached battery packs data: {str(e)}")
+        return {"status": "error", "message": str(e)}
+
+
+async def open_battery_pack_stream(filters: BatteryPackFilters) -> AsyncIterator[bytes]:
+    """NDJSON body with one line per pack, read from a server-side cursor.
+
+    The connection is acquired and the cursor opened here, before the caller
+    sends any headers, so a saturated pool or a bad query is still answered
+    with a proper status code. The returned iterator owns the connection and
+    releases it when the stream ends. LIMIT NULL = no limit.
+    """
+    filters = filters.copy(update={"limit": None})
+    conn = await get_read_db_connection()
+    try:
+        # asyncpg cursors only live inside a transaction
+        transaction = conn.transaction(readonly=True)
+        await transaction.start()
+        statement = await conn.prepared("battery_pack_stream")
+        cursor = await statement.cursor(*battery_pack_query_args(filters))
+    except BaseException:
+        await release_db_connection(conn)
+        raise
+    return _stream_cursor(conn, transaction, cursor)
+
+
+async def _stream_cursor(conn, transaction, cursor) -> AsyncIterator[bytes]:
+    try:
+        while True:
+            records = await cursor.fetch(STREAM_PREFETCH)
+            if not records:
+                break
+            # Compact JSON text, which is already a line
+            yield "".join(record["result"] + "\n" for record in records).encode("utf-8")
+    except Exception as e:
+        # Headers are already sent; all we can do is stop the stream
+        logging.error(f"Error streaming battery packs data: {str(e)}")
     finally:
+        try:
+            await transaction.rollback()
+        except Exception as e:
+            logging.error(f"Error closing battery pack stream: {str(e)}")
         await release_db_connection(conn)
 
 
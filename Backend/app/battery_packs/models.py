@@ -1,8 +1,11 @@
 # models.py
 
-from pydantic import BaseModel
+from pydantic import BaseModel, conlist
 from typing import List, Optional
 
+# Upper bound on items per bulk write request
+MAX_BULK_SIZE = 1000
+
 
 class BatteryPack(BaseModel):
     battery_cell_chemistry: str
@@ -46,3 +49,58 @@ class BatteryPackItem(BaseModel):
 
 class BatteryPackResponse(BaseModel):
     __root__: List[BatteryPackItem]
+
+
+class BatteryPackFilters(BaseModel):
+    status_label: Optional[str] = None
+    company: Optional[str] = None
+    location: Optional[str] = None
+    battery_pack_state: Optional[str] = None
+    soc_min: Optional[float] = None
+    soc_max: Optional[float] = None
+    soh_min: Optional[float] = None
+    soh_max: Optional[float] = None
+    after: Optional[str] = None  # keyset cursor: last asset_tag of the previous page
+    limit: Optional[int] = 100  # None means no LIMIT (stream mode)
+
+
+class BatteryPackAttributes(BaseModel):
+    battery_cell_chemistry: Optional[str] = None
+    battery_cell_temperatures: Optional[str] = None
+    battery_cell_type: Optional[str] = None
+    battery_cell_voltages: Optional[str] = None
+    battery_pack_casing: Optional[str] = None
+    battery_pack_nominal_charge_capacity: Optional[float] = None
+    battery_pack_nominal_voltage: Optional[float] = None
+    bms_type: Optional[str] = None
+
+
+class BatteryPackWrite(BaseModel):
+    # Names are resolved to snipe-it ids in SQL; None leaves a field untouched
+    # on update
+    asset_tag: str
+    status_label: Optional[str] = None
+    company_name: Optional[str] = None
+    location: Optional[str] = None
+    warranty_duration: Optional[int] = None
+    battery_pack: BatteryPackAttributes = BatteryPackAttributes()
+
+
+class BatteryPackWriteResult(BaseModel):
+    asset_tag: str
+    status: str
+    message: Optional[str] = None
+
+
+class BatteryPackWriteResults(BaseModel):
+    results: List[BatteryPackWriteResult]
+
+
+class BatteryPackWriteResponse(BaseModel):
+    # Bulk create, update and decommission: one result per input pack, in order
+    status: str
+    result: BatteryPackWriteResults
+
+
+class BatteryPackDecommission(BaseModel):
+    asset_tags: conlist(str, min_items=1, max_items=MAX_BULK_SIZE)
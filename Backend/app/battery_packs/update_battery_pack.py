@@ -0,0 +1,62 @@
+# update_battery_pack.py
+
+import logging
+from typing import Any, Dict, List
+
+from app.db import get_db_connection, release_db_connection
+
+from .cache import invalidate_battery_pack_cache
+from .create_battery_pack import RESOLVED_STAGING_CTE, write_battery_packs
+from .models import BatteryPackWrite
+
+# Fields left as None keep their current value
+UPDATE_BATTERY_PACKS_QUERY = f"""
+WITH {RESOLVED_STAGING_CTE.format(
+    existence_error="WHEN NOT st.found THEN 'battery pack not found'",
+    found_condition="AND a.model_id = 7",
+)},
+written AS (
+  UPDATE "snipe-it".assets a SET
+    status_id = COALESCE(c.status_id, a.status_id),
+    company_id = COALESCE(c.company_id, a.company_id),
+    location_id = COALESCE(c.location_id, a.location_id),
+    warranty_months = COALESCE(c.warranty_months, a.warranty_months),
+    _snipeit_battery_cell_chemistry_18 = COALESCE(c.battery_cell_chemistry, a._snipeit_battery_cell_chemistry_18),
+    _snipeit_battery_cell_temperatures_54 = COALESCE(c.battery_cell_temperatures, a._snipeit_battery_cell_temperatures_54),
+    _snipeit_battery_cell_type_24 = COALESCE(c.battery_cell_type, a._snipeit_battery_cell_type_24),
+    _snipeit_battery_cell_voltages_53 = COALESCE(c.battery_cell_voltages, a._snipeit_battery_cell_voltages_53),
+    _snipeit_battery_pack_casing_25 = COALESCE(c.battery_pack_casing, a._snipeit_battery_pack_casing_25),
+    _snipeit_battery_pack_nominal_charge_capacity_22 = COALESCE(c.battery_pack_nominal_charge_capacity, a._snipeit_battery_pack_nominal_charge_capacity_22),
+    _snipeit_battery_pack_nominal_voltage_21 = COALESCE(c.battery_pack_nominal_voltage, a._snipeit_battery_pack_nominal_voltage_21),
+    _snipeit_bms_type_23 = COALESCE(c.bms_type, a._snipeit_bms_type_23),
+    updated_at = now()
+  FROM checked c
+  WHERE c.error IS NULL
+    AND a.asset_tag = c.asset_tag
+    AND a.model_id = 7
+    AND a.deleted_at IS NULL
+  RETURNING a.asset_tag
+)
+SELECT c.asset_tag, c.error
+FROM checked c
+ORDER BY c.ord
+"""
+
+
+async def update_battery_packs(packs: List[BatteryPackWrite]) -> Dict[str, Any]:
+    conn = await get_db_connection()
+    try:
+        async with conn.transaction():
+            results = await write_battery_packs(
+                conn, packs, UPDATE_BATTERY_PACKS_QUERY, done="updated"
+            )
+    except Exception as e:
+        logging.error(f"Error updating battery packs: {str(e)}")
+        return {"status": "error", "message": str(e)}
+    finally:
+        await release_db_connection(conn)
+
+    await invalidate_battery_pack_cache(
+        [r["asset_tag"] for r in results if r["status"] == "updated"]
+    )
+    return {"status": "updated", "result": results}
@@ -0,0 +1,66 @@
+# watch_battery_packs.py
+
+import asyncio
+import logging
+import os
+from typing import AsyncIterator, Optional, Set
+
+from app.utils import json_loads
+
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+# Deltas buffered per client before the oldest ones are dropped
+SSE_CLIENT_QUEUE_SIZE = int(os.getenv("SSE_CLIENT_QUEUE_SIZE", "256"))
+
+
+class _DeltaHub:
+    """Fans deltas from this worker's Postgres NOTIFY listener (app.notify)
+    out to its connected event-stream clients."""
+
+    def __init__(self):
+        self.subscribers: Set[asyncio.Queue] = set()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SSE_CLIENT_QUEUE_SIZE)
+        self.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self.subscribers.discard(queue)
+
+    def publish(self, payload: str):
+        try:
+            asset_tag = json_loads(payload)["asset_tag"]
+        except Exception:
+            logging.error(f"Ignoring malformed battery pack delta: {payload!r}")
+            return
+        for queue in self.subscribers:
+            if queue.full():
+                # Slow client: it loses its oldest delta rather than stalling others
+                queue.get_nowait()
+            queue.put_nowait((asset_tag, payload))
+
+
+DELTA_HUB = _DeltaHub()
+
+
+async def battery_pack_events(
+    asset_tags: Optional[Set[str]] = None,
+) -> AsyncIterator[str]:
+    # Server-sent events: one `measurement` event per changed pack, optionally
+    # limited to asset_tags, with comment heartbeats to keep proxies open
+    queue = DELTA_HUB.subscribe()
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                asset_tag, payload = await asyncio.wait_for(
+                    queue.get(), SSE_HEARTBEAT_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            if asset_tags and asset_tag not in asset_tags:
+                continue
+            yield f"event: measurement\ndata: {payload}\n\n"
+    finally:
+        DELTA_HUB.unsubscribe(queue)
@@ -1,15 +1,57 @@
+import asyncio
+import bisect
+import itertools
 import logging
 import os
 import sys
+import time
 import asyncpg
+from asyncpg.prepared_stmt import PreparedStatement
 from dotenv import load_dotenv
 from redis import asyncio as aioredis
-from typing import Optional
+from typing import Any, Awaitable, Dict, List, Optional
+
+from app.utils import json_dumps, json_loads
 
 load_dotenv()
 
 DB_POOL = None
 
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "5"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "30"))
+# Seconds a request may wait for a pooled connection before giving up
+DB_ACQUIRE_TIMEOUT = float(os.getenv("DB_ACQUIRE_TIMEOUT", "5"))
+# Requests allowed to queue for a connection; past that they are shed at once
+DB_MAX_WAITERS = int(os.getenv("DB_MAX_WAITERS", str(2 * DB_POOL_MAX_SIZE)))
+# Retry-After (seconds) sent with the 503 when load is shed
+DB_RETRY_AFTER = int(os.getenv("DB_RETRY_AFTER", "1"))
+# Seconds the pools wait on shutdown for connections still in use
+DB_CLOSE_TIMEOUT = float(os.getenv("DB_CLOSE_TIMEOUT", "10"))
+
+# Optional read replicas as "host[:port],host[:port]"; same credentials as the
+# primary. Read-only queries are spread over them, writes stay on the primary.
+DB_REPLICA_HOSTNAMES = [
+    name.strip()
+    for name in os.getenv("POSTGRES_REPLICA_HOSTNAMES", "").split(",")
+    if name.strip()
+]
+DB_REPLICA_HEALTH_INTERVAL = float(os.getenv("DB_REPLICA_HEALTH_INTERVAL", "5"))
+# A replica further behind than this (seconds) is taken out of rotation
+DB_REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+
+# Replay lag in seconds; 0 when the replica has applied everything it received,
+# so an idle primary does not look like lag. 0 on a primary too.
+REPLICA_LAG_QUERY = """
+SELECT CASE
+  WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+  ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END::float8
+"""
+
+# Hot queries prepared on every pooled connection, by name. Modules register
+# theirs at import time with register_prepared_query().
+PREPARED_QUERIES: Dict[str, str] = {}
+
 logging.basicConfig(
     level=os.getenv("LOGGING_LEVEL", "DEBUG"),
     format="%(asctime)s - %(levelname)s - %(message)s",
@@ -17,44 +59,299 @@ logging.basicConfig(
 )
 
 
-# Initialize Postgres Database Connection Pool
+# Connection settings shared by the pool and dedicated connections
+def db_connect_kwargs() -> dict:
+    return dict(
+        user=os.getenv("POSTGRES_USERNAME"),
+        password=os.getenv("POSTGRES_PASSWORD"),
+        database=os.getenv("POSTGRES_DATABASE"),
+        host=os.getenv("POSTGRES_HOSTNAME"),
+        port=int(os.getenv("POSTGRES_PORTNUMBER", "5432")),
+    )
+
+
+def register_prepared_query(name: str, query: str):
+    PREPARED_QUERIES[name] = query
+
+
+class PreparedConnection(asyncpg.Connection):
+    """asyncpg connection that keeps the registered hot queries prepared."""
+
+    __slots__ = ("_prepared_statements",)
+
+    async def prepared(self, name: str) -> PreparedStatement:
+        # Normally filled by _init_connection; prepared lazily if that failed
+        try:
+            statements = self._prepared_statements
+        except AttributeError:
+            statements = self._prepared_statements = {}
+        statement = statements.get(name)
+        if statement is None:
+            statement = statements[name] = await self.prepare(PREPARED_QUERIES[name])
+        return statement
+
+
+# Session settings sent as startup parameters, so they also survive the
+# RESET ALL asyncpg runs when a connection goes back to the pool
+def db_server_settings() -> Dict[str, str]:
+    return {
+        "application_name": os.getenv("POSTGRES_APPLICATION_NAME", "preksha-backend"),
+        "statement_timeout": os.getenv("POSTGRES_STATEMENT_TIMEOUT", "60000"),
+        "work_mem": os.getenv("POSTGRES_WORK_MEM", "16MB"),
+        # The listing is many short plans; JIT compile time only adds latency
+        "jit": os.getenv("POSTGRES_JIT", "off"),
+        # The prepared listing queries have optional predicates
+        # ($1 IS NULL OR asset_tag > $1, ...). A generic plan, which Postgres
+        # may switch to after five runs, cannot turn those into an index range
+        # scan, so every execution is planned for its actual arguments.
+        "plan_cache_mode": os.getenv("POSTGRES_PLAN_CACHE_MODE", "force_custom_plan"),
+    }
+
+
+# Runs once for every new pooled connection
+async def _init_connection(conn: PreparedConnection):
+    # json/jsonb decoded by orjson in C instead of returned as text
+    for type_name in ("json", "jsonb"):
+        await conn.set_type_codec(
+            type_name,
+            encoder=lambda value: json_dumps(value).decode("utf-8"),
+            decoder=json_loads,
+            schema="pg_catalog",
+        )
+    for name in PREPARED_QUERIES:
+        try:
+            await conn.prepared(name)
+        except Exception as e:
+            logging.error(f"Error preparing query {name}: {e}")
+
+
+class PoolSaturated(Exception):
+    """No pooled connection is available soon enough; answered with a 503."""
+
+    def __init__(self, message: str, retry_after: int = DB_RETRY_AFTER):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PoolMetrics:
+    # Upper bounds (seconds) of the acquire latency histogram buckets
+    BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+    def __init__(self):
+        self.waiters = 0
+        self.acquired = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.acquire_seconds_sum = 0.0
+        self.bucket_counts = [0] * (len(self.BUCKETS) + 1)
+
+    def observe_acquire(self, seconds: float):
+        self.acquired += 1
+        self.acquire_seconds_sum += seconds
+        self.bucket_counts[bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def snapshot(self, pool: Optional[asyncpg.Pool]) -> Dict[str, Any]:
+        size = pool.get_size() if pool else 0
+        idle = pool.get_idle_size() if pool else 0
+        cumulative, histogram = 0, {}
+        for bound, count in zip(self.BUCKETS + (float("inf"),), self.bucket_counts):
+            cumulative += count
+            histogram["+Inf" if bound == float("inf") else str(bound)] = cumulative
+        return {
+            "size": size,
+            "max_size": pool.get_max_size() if pool else 0,
+            "in_use": size - idle,
+            "idle": idle,
+            "waiters": self.waiters,
+            "acquired": self.acquired,
+            "timeouts": self.timeouts,
+            "rejected": self.rejected,
+            "acquire_seconds_sum": self.acquire_seconds_sum,
+            "acquire_seconds_bucket": histogram,
+        }
+
+
+POOL_METRICS = PoolMetrics()
+
+
+REPLICAS: List["ReplicaPool"] = []
+_REPLICA_TURN = itertools.count()
+
+# Pool each checked-out connection came from, so release goes back to it
+_CONNECTION_POOLS: Dict[int, asyncpg.Pool] = {}
+
+
+class ReplicaPool:
+    """A read replica's pool, its metrics and what the health check last saw."""
+
+    def __init__(self, name: str, pool: asyncpg.Pool):
+        self.name = name
+        self.pool = pool
+        self.metrics = PoolMetrics()
+        self.healthy = True
+        self.lag_seconds: Optional[float] = None
+
+
+def _create_pool(**connect_kwargs) -> Awaitable[asyncpg.Pool]:
+    return asyncpg.create_pool(
+        **connect_kwargs,
+        min_size=DB_POOL_MIN_SIZE,
+        max_size=DB_POOL_MAX_SIZE,
+        connection_class=PreparedConnection,
+        server_settings=db_server_settings(),
+        init=_init_connection,
+    )
+
+
+# Initialize Postgres Database Connection Pool, plus one per configured replica
 async def init_db():
     global DB_POOL
     if DB_POOL is None:
         try:
-            DB_POOL = await asyncpg.create_pool(
-                user=os.getenv("POSTGRES_USERNAME"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                database=os.getenv("POSTGRES_DATABASE"),
-                host=os.getenv("POSTGRES_HOSTNAME"),
-                port=int(os.getenv("POSTGRES_PORTNUMBER", "5432")),
-                min_size=5,
-                max_size=30,
-            )
+            DB_POOL = await _create_pool(**db_connect_kwargs())
             logging.info("🔌 Postgres DB pool initialized")
         except Exception as e:
             logging.error(f"Failed to initialize Postgres DB pool: {e}")
             raise
 
+        # Replicas are optional: one that is down now is skipped, reads fall
+        # back to the primary
+        for name in DB_REPLICA_HOSTNAMES:
+            host, _, port = name.partition(":")
+            try:
+                pool = await _create_pool(
+                    **{**db_connect_kwargs(), "host": host, "port": int(port or 5432)}
+                )
+            except Exception as e:
+                logging.error(f"Failed to initialize replica pool {name}: {e}")
+                continue
+            REPLICAS.append(ReplicaPool(name, pool))
+            logging.info(f"🔌 Replica pool {name} initialized")
 
-# Acquire a DB connection from the pool (no async generator)
-async def get_db_connection() -> asyncpg.Connection:
+
+def _has_room(pool: asyncpg.Pool, metrics: PoolMetrics) -> bool:
+    return metrics.waiters < DB_MAX_WAITERS or pool.get_idle_size() > 0
+
+
+# Shed the request up front if the wait queue for connections is already full
+def check_db_admission():
     if DB_POOL is None:
         raise RuntimeError("Database pool not initialized. Call init_db() first.")
+    if not _has_room(DB_POOL, POOL_METRICS):
+        POOL_METRICS.rejected += 1
+        raise PoolSaturated("Database pool saturated")
+
+
+async def _acquire(pool: asyncpg.Pool, metrics: PoolMetrics) -> asyncpg.Connection:
+    metrics.waiters += 1
+    started = time.perf_counter()
+    try:
+        conn = await pool.acquire(timeout=DB_ACQUIRE_TIMEOUT)
+        metrics.observe_acquire(time.perf_counter() - started)
+    except asyncio.TimeoutError:
+        metrics.timeouts += 1
+        logging.warning(f"Timed out after {DB_ACQUIRE_TIMEOUT}s acquiring a DB connection")
+        raise PoolSaturated("Timed out waiting for a database connection") from None
+    finally:
+        metrics.waiters -= 1
+    _CONNECTION_POOLS[id(conn)] = pool
+    logging.debug("Acquired a DB connection")
+    return conn
+
+
+# Acquire a DB connection from the primary pool (no async generator)
+async def get_db_connection() -> asyncpg.Connection:
+    check_db_admission()
     try:
-        conn = await DB_POOL.acquire()
-        logging.debug("Acquired a DB connection")
-        return conn
+        return await _acquire(DB_POOL, POOL_METRICS)
+    except PoolSaturated:
+        raise
     except Exception as e:
         logging.error(f"Error acquiring DB connection: {e}")
         raise
 
 
-# Release DB connection back to the pool
+# Acquire a connection for a read-only query: the next healthy replica with
+# room, round-robin, or the primary when there is none. Never use it to write,
+# nor for results that get cached: a lagging replica would put the old row
+# back into the cache right after a change invalidated it.
+async def get_read_db_connection() -> asyncpg.Connection:
+    healthy = [r for r in REPLICAS if r.healthy]
+    if healthy:
+        turn = next(_REPLICA_TURN)
+        for i in range(len(healthy)):
+            replica = healthy[(turn + i) % len(healthy)]
+            if not _has_room(replica.pool, replica.metrics):
+                continue
+            try:
+                return await _acquire(replica.pool, replica.metrics)
+            except PoolSaturated:
+                continue
+            except Exception as e:
+                # Taken out of rotation until the health check sees it again
+                replica.healthy = False
+                logging.error(f"Error acquiring connection from replica {replica.name}: {e}")
+    return await get_db_connection()
+
+
+async def _probe_replica(replica: ReplicaPool):
+    try:
+        async with replica.pool.acquire(timeout=DB_ACQUIRE_TIMEOUT) as conn:
+            lag = await conn.fetchval(REPLICA_LAG_QUERY, timeout=DB_ACQUIRE_TIMEOUT)
+    except Exception as e:
+        if replica.healthy:
+            logging.warning(f"Replica {replica.name} failed its health check: {e}")
+        replica.healthy, replica.lag_seconds = False, None
+        return
+    healthy = lag <= DB_REPLICA_MAX_LAG
+    if healthy != replica.healthy:
+        logging.info(f"Replica {replica.name} {'back in' if healthy else 'out of'} rotation (lag {lag:.1f}s)")
+    replica.healthy, replica.lag_seconds = healthy, lag
+
+
+# Background task: keeps the healthy flags current so reads only go to
+# replicas that answer and are not too far behind the primary
+async def monitor_replica_health():
+    while REPLICAS:
+        await asyncio.gather(*(_probe_replica(r) for r in REPLICAS))
+        await asyncio.sleep(DB_REPLICA_HEALTH_INTERVAL)
+
+
+def db_pool_metrics() -> Dict[str, Any]:
+    return {
+        "primary": POOL_METRICS.snapshot(DB_POOL),
+        "replicas": {
+            r.name: {
+                "healthy": r.healthy,
+                "lag_seconds": r.lag_seconds,
+                **r.metrics.snapshot(r.pool),
+            }
+            for r in REPLICAS
+        },
+    }
+
+
+# Close the primary and replica pools on shutdown. Connections still checked
+# out get DB_CLOSE_TIMEOUT seconds to come back before they are terminated.
+async def close_db():
+    global DB_POOL
+    pools = ([DB_POOL] if DB_POOL is not None else []) + [r.pool for r in REPLICAS]
+    for pool in pools:
+        try:
+            await asyncio.wait_for(pool.close(), DB_CLOSE_TIMEOUT)
+        except Exception as e:
+            logging.warning(f"DB pool did not close cleanly, terminating: {e}")
+            pool.terminate()
+    DB_POOL = None
+    REPLICAS.clear()
+    _CONNECTION_POOLS.clear()
+
+
+# Release DB connection back to the pool it came from
 async def release_db_connection(conn: asyncpg.Connection):
     if conn:
         try:
-            await DB_POOL.release(conn)
+            await _CONNECTION_POOLS.pop(id(conn), DB_POOL).release(conn)
             logging.debug("Released DB connection")
         except Exception as e:
             logging.error(f"Error releasing DB connection: {e}")
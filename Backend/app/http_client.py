@@ -0,0 +1,44 @@
+import logging
+import os
+from typing import Optional
+
+import httpx
+
+# One client for the app's lifetime, so calls to the identity provider reuse
+# warm keep-alive (HTTP/2) connections instead of a new TCP+TLS handshake each
+HTTP_CLIENT: Optional[httpx.AsyncClient] = None
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+
+
+def init_http_client() -> httpx.AsyncClient:
+    global HTTP_CLIENT
+    if HTTP_CLIENT is None:
+        HTTP_CLIENT = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        )
+        logging.info("🌐 HTTP client initialized")
+    return HTTP_CLIENT
+
+
+def get_http_client() -> httpx.AsyncClient:
+    if HTTP_CLIENT is None:
+        raise RuntimeError("HTTP client not initialized. Call init_http_client() first.")
+    return HTTP_CLIENT
+
+
+async def close_http_client():
+    global HTTP_CLIENT
+    if HTTP_CLIENT is not None:
+        await HTTP_CLIENT.aclose()
+        HTTP_CLIENT = None
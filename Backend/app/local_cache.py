@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+from app.db import redis_client
+from app.utils import json_dumps, json_loads
+
+# Redis pub/sub channel used to drop entries in every worker at once
+INVALIDATION_CHANNEL = "cache:invalidate"
+# Tags this worker's messages: it is subscribed to its own channel, and must
+# not drop what it just stored (its own local tier is updated directly)
+WORKER_ID = secrets.token_hex(8)
+
+
+class LocalCache:
+    """Per-worker LRU cache with a TTL on each entry.
+
+    Values are kept as-is (decoded objects or ready-to-send bodies), so a hit
+    costs a dict lookup. Not shared between workers; use invalidate_cache()
+    to drop entries everywhere.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def delete(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+    def delete_prefix(self, *prefixes: str):
+        for key in [k for k in self._entries if k.startswith(tuple(prefixes))]:
+            del self._entries[key]
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+LOCAL_CACHE = LocalCache(
+    max_entries=int(os.getenv("LOCAL_CACHE_MAX_ENTRIES", "1024")),
+    ttl=float(os.getenv("LOCAL_CACHE_TTL", "30")),
+)
+
+
+async def invalidate_cache(
+    keys: Iterable[str] = (), prefixes: Iterable[str] = (), broadcast: bool = True
+):
+    """Drop entries from Redis and from the local tier of every worker.
+
+    Pass broadcast=False when every worker is already running the same
+    invalidation (e.g. all of them received the same Postgres NOTIFY).
+    """
+    keys, prefixes = list(keys), list(prefixes)
+    LOCAL_CACHE.delete(*keys)
+    LOCAL_CACHE.delete_prefix(*prefixes)
+    try:
+        redis_keys = list(keys)
+        for prefix in prefixes:
+            redis_keys.extend([key async for key in redis_client.scan_iter(f"{prefix}*")])
+        if redis_keys:
+            await redis_client.delete(*redis_keys)
+        if broadcast:
+            await publish_invalidation(keys, prefixes)
+    except Exception as e:
+        logging.error(f"Error invalidating cache entries: {e}")
+
+
+async def publish_invalidation(keys: Iterable[str] = (), prefixes: Iterable[str] = ()):
+    # Only the other workers' local tiers are told; Redis itself is left
+    # untouched, and the caller updates its own local tier
+    message = {"origin": WORKER_ID, "keys": list(keys), "prefixes": list(prefixes)}
+    await redis_client.publish(INVALIDATION_CHANNEL, json_dumps(message))
+
+
+async def listen_for_invalidations():
+    """Apply invalidations published by any worker to this worker's local tier.
+
+    Runs for the lifetime of the app. After a dropped subscription the local
+    tier is cleared, since messages may have been missed in between.
+    """
+    while True:
+        pubsub = redis_client.pubsub()
+        try:
+            await pubsub.subscribe(INVALIDATION_CHANNEL)
+            logging.info("📡 Listening for cache invalidations")
+            async for message in pubsub.listen():
+                if message["type"] != "message":
+                    continue
+                payload = json_loads(message["data"])
+                if payload.get("origin") == WORKER_ID:
+                    continue
+                LOCAL_CACHE.delete(*payload.get("keys", []))
+                LOCAL_CACHE.delete_prefix(*payload.get("prefixes", []))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Cache invalidation listener failed, retrying: {e}")
+            LOCAL_CACHE.clear()
+            await asyncio.sleep(1)
+        finally:
+            await pubsub.aclose()
@@ -1,44 +1,47 @@
+import logging
 import time
-import httpx
-from starlette.middleware.base import BaseHTTPMiddleware
-from starlette.requests import Request
-from starlette.responses import Response
 from fastapi import HTTPException
-
-
-class TokenRefreshMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        # Extract session data
-        session = request.session
-        access_token = session.get("access_token")
-        refresh_token = session.get("refresh_token")
-        expires_at = session.get("access_token_expires_at")
-
-        current_time = time.time()
-
-        # Token expiration check
-        if access_token and expires_at and current_time >= expires_at:
-            # Attempt token refresh
-            try:
-                async with httpx.AsyncClient() as client:
-                    response = await client.post(
-                        url="http://localhost:8000/refresh",  # Adjust the URL if necessary
-                        json={"refresh_token": refresh_token},
-                    )
-                if response.status_code != 200:
-                    return Response("Unauthorized", status_code=401)
-
-                token_data = response.json()
-                session["access_token"] = token_data["access_token"]
-                session["refresh_token"] = token_data["refresh_token"]
-                session["access_token_expires_at"] = (
-                    current_time + token_data["expires_in"]
-                )
-            except Exception as e:
-                return Response("Internal Server Error", status_code=500)
-
-        # Continue with request processing
-        return await call_next(request)
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.auth import TokenRefreshError, refresh_tokens, store_tokens
+
+
+class TokenRefreshMiddleware:
+    """Refreshes an expired access token when a route loads the session.
+
+    Plain ASGI rather than BaseHTTPMiddleware: the response, streaming or
+    not, is passed through untouched. The check is registered as a load hook
+    on the lazy session, so requests that never load it (the listing, streams)
+    pay nothing. Must sit inside RedisSessionMiddleware, which puts the
+    session in the scope.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        session = scope.get("session")
+        if scope["type"] == "http" and session is not None:
+            session.on_load(refresh_if_expired)
+
+        await self.app(scope, receive, send)
+
+
+async def refresh_if_expired(session):
+    # Updates the session in place; raises the error response on failure
+    expires_at = session.get("access_token_expires_at")
+    if not (expires_at and time.time() >= expires_at and session.get("access_token")):
+        return
+    refresh_token = session.get("refresh_token")
+    if not refresh_token:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    try:
+        store_tokens(session, await refresh_tokens(refresh_token))
+    except TokenRefreshError:
+        raise HTTPException(status_code=401, detail="Unauthorized")
+    except Exception as e:
+        logging.error(f"Token refresh error: {e}")
+        raise HTTPException(status_code=500, detail="Internal Server Error")
 
 
 # from starlette.middleware.base import BaseHTTPMiddleware
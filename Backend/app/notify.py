@@ -0,0 +1,139 @@
+import asyncio
+import logging
+import os
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import asyncpg
+
+from app.battery_packs.cache import forget_local_battery_packs, mark_battery_packs_stale
+from app.battery_packs.watch_battery_packs import DELTA_HUB
+from app.db import db_connect_kwargs, redis_client
+from app.utils import get_md5_hash, json_loads
+
+# Fired by the triggers in migrations/004_battery_pack_change_notifications.sql
+BATTERY_PACK_CHANNEL = "battery_pack_changes"
+# Fired by the trigger in migrations/005_battery_pack_measurement_deltas.sql
+MEASUREMENT_CHANNEL = "battery_pack_measurements"
+
+# Telemetry can notify many times a second; changes are gathered and flushed
+# at most once per interval so the caches are not rebuilt on every insert
+NOTIFY_FLUSH_INTERVAL = float(os.getenv("NOTIFY_FLUSH_INTERVAL", "1"))
+
+# Every worker receives each notification; the first to SET NX its claim key
+# applies it to Redis, the others only to their own local tier
+NOTIFY_CLAIM_PREFIX = "battery_packs:notify:"
+NOTIFY_CLAIM_TTL = 60
+
+# A batch needs the widest reindex any of its changes asked for
+_REINDEX_RANK = {"measurements": 1, "all": 2}
+
+
+class _PendingChanges:
+    def __init__(self):
+        # Parsed notifications keyed by their raw payload, which is unique
+        # (it carries the txid) and the same in every worker
+        self.notifications: Dict[str, dict] = {}
+        self.everything = False
+
+    def add(self, payload: str):
+        try:
+            self.notifications[payload] = json_loads(payload)
+        except Exception:
+            logging.error(f"Ignoring malformed NOTIFY payload: {payload!r}")
+
+    def take(self) -> Tuple[Dict[str, dict], bool]:
+        taken = self.notifications, self.everything
+        self.notifications, self.everything = {}, False
+        return taken
+
+
+def _merge(notifications: Iterable[dict]) -> Tuple[Optional[Set[str]], Optional[str]]:
+    # Changed packs (None: unknown, so all of them) and the widest reindex
+    asset_tags: Optional[Set[str]] = set()
+    reindex = None
+    for data in notifications:
+        if data.get("all"):
+            return None, "all"
+        asset_tags.update(data.get("asset_tags") or [])
+        if _REINDEX_RANK.get(data.get("reindex"), 0) > _REINDEX_RANK.get(reindex, 0):
+            reindex = data["reindex"]
+    return asset_tags, reindex
+
+
+async def _claim(payloads: List[str]) -> List[str]:
+    # The payloads this worker is the first to see
+    async with redis_client.pipeline(transaction=False) as pipe:
+        for payload in payloads:
+            pipe.set(
+                f"{NOTIFY_CLAIM_PREFIX}{get_md5_hash(payload)}", 1, nx=True, ex=NOTIFY_CLAIM_TTL
+            )
+        claimed = await pipe.execute()
+    return [payload for payload, won in zip(payloads, claimed) if won]
+
+
+async def _flush(pending: _PendingChanges):
+    notifications, reconnected = pending.take()
+    if not notifications and not reconnected:
+        return
+
+    asset_tags, reindex = (None, "all") if reconnected else _merge(notifications.values())
+    forget_local_battery_packs(asset_tags)
+
+    try:
+        if reconnected:
+            # What was missed is unknown to everyone, so there is nothing to
+            # claim; rare enough to redo in every worker that lost its listener
+            claimed_tags, claimed_reindex = None, "all"
+        else:
+            claimed = await _claim(list(notifications))
+            if not claimed:
+                return
+            claimed_tags, claimed_reindex = _merge(notifications[p] for p in claimed)
+        logging.debug(f"🔔 Marking battery packs stale: {claimed_tags or 'all'}")
+        await mark_battery_packs_stale(claimed_tags, claimed_reindex)
+    except Exception as e:
+        logging.error(f"Error invalidating battery pack caches: {e}")
+
+
+async def listen_for_battery_pack_changes():
+    """Mark battery pack caches stale when Postgres reports a change, and
+    hand live measurement deltas to this worker's event-stream clients.
+
+    Holds one dedicated connection (LISTEN does not mix with pooled
+    connections) for the lifetime of the app and reconnects when it drops.
+    Anything that changed while disconnected is unknown, so a reconnect
+    starts with a full invalidation.
+    """
+    pending = _PendingChanges()
+    while True:
+        conn = None
+        try:
+            conn = await asyncpg.connect(**db_connect_kwargs())
+            lost = asyncio.Event()
+            conn.add_termination_listener(lambda _: lost.set())
+            await conn.add_listener(
+                BATTERY_PACK_CHANNEL, lambda *args: pending.add(args[-1])
+            )
+            await conn.add_listener(
+                MEASUREMENT_CHANNEL, lambda *args: DELTA_HUB.publish(args[-1])
+            )
+            logging.info(
+                f"📡 Listening on Postgres channels {BATTERY_PACK_CHANNEL}, {MEASUREMENT_CHANNEL}"
+            )
+
+            while not lost.is_set():
+                try:
+                    await asyncio.wait_for(lost.wait(), NOTIFY_FLUSH_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+                await _flush(pending)
+            raise ConnectionError("LISTEN connection lost")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Postgres NOTIFY listener failed, retrying: {e}")
+            pending.everything = True
+            await asyncio.sleep(1)
+        finally:
+            if conn is not None and not conn.is_closed():
+                await conn.close()
@@ -1,15 +1,27 @@
-from app import redis_client
-from app import get_db_connection
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+
 import asyncpg
-import json
 
-from app.utils import get_md5_hash, json_serialiser
-from app import logging
+from app.db import get_db_connection, redis_client, release_db_connection
+from app.local_cache import LOCAL_CACHE, publish_invalidation
+from app.singleflight import single_flight, single_flight_key
+from app.utils import get_md5_hash, json_dumps, json_loads
+
 
+async def _fetch_rows(query: str, params: dict):
+    # Runs inside the shared single_flight task, so it owns its connection: no
+    # waiter ever touches a connection another request has released. The rows
+    # are cached, so they come from the primary, never a lagging replica.
+    conn = await get_db_connection()
+    try:
+        return await conn.fetch(query=query, **params, timeout=600)
+    finally:
+        await release_db_connection(conn)
 
-async def fetch_cache_aware(db: asyncpg.Connection, query: str, params: dict):
-    results = []
 
+async def fetch_cache_aware(db: Optional[asyncpg.Connection], query: str, params: dict):
     # Use a hardcoded email for the key
     hardcoded_email = "test@example.com"
 
@@ -17,13 +29,19 @@ async def fetch_cache_aware(db: asyncpg.Connection, query: str, params: dict):
     query_hash = get_md5_hash(f"{query}_{str(params)}")
     cache_key = f"query_results:{hardcoded_email}:{query_hash}"
 
+    # Already-decoded results held by this worker
+    results = LOCAL_CACHE.get(cache_key)
+    if results is not None:
+        logging.debug(f"Query {cache_key} served from the local cache")
+        return results
+
     # Check if the key exists in Redis
-    if await redis_client.keys(cache_key):
+    query_results_str = await redis_client.get(cache_key)
+    if query_results_str is not None:
         logging.debug(f"Query {cache_key} is already cached")
 
-        # Retrieve the cached result
-        query_results_str = await redis_client.get(cache_key)
-        results = json.loads(query_results_str)
+        results = json_loads(query_results_str)
+        LOCAL_CACHE.set(cache_key, results)
 
         logging.debug(f"Cached result retrieved: {str(results)}")
         return results
@@ -31,8 +49,18 @@ async def fetch_cache_aware(db: asyncpg.Connection, query: str, params: dict):
     else:
         logging.debug("Query is not cached. Fetching from the database.")
 
-        # Fetch data from the database
-        rows = await db.fetch(query=query, **params, timeout=600)
+        results = []
+
+        if db is None:
+            # Concurrent misses share one query on a connection of its own
+            rows = await single_flight(
+                single_flight_key(query, sorted(params.items())),
+                lambda: _fetch_rows(query, params),
+            )
+        else:
+            # The caller's connection may be inside its own transaction, so it
+            # is only ever used by this call
+            rows = await db.fetch(query=query, **params, timeout=600)
         for row in rows:
             result = {}
             for key, value in row.items():
@@ -42,12 +70,177 @@ async def fetch_cache_aware(db: asyncpg.Connection, query: str, params: dict):
 
         # Cache the results in Redis
         logging.debug(f"Caching results to Redis with key: {cache_key}")
-        await redis_client.set(
-            cache_key, json.dumps(results, default=json_serialiser), ex=1 * 60
-        )
+        await redis_client.set(cache_key, json_dumps(results), ex=1 * 60)
 
     return results
 
+# Background refreshes started by fetch_stale_while_revalidate; held here so the
+# event loop does not garbage-collect them mid-flight
+_REFRESH_TASKS: Set[asyncio.Task] = set()
+
+# Deletes a lock only while it still holds the caller's token
+_RELEASE_LOCK_SCRIPT = redis_client.register_script(
+    """
+    if redis.call("get", KEYS[1]) == ARGV[1] then
+      return redis.call("del", KEYS[1])
+    end
+    return 0
+    """
+)
+
+
+async def release_lock(lock_key: str, owner: str):
+    # Only the holder deletes a SET NX lock; one that outlived its TTL must
+    # not drop the lock another worker has taken since
+    try:
+        await _RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[owner])
+    except Exception as e:
+        logging.error(f"Error releasing lock {lock_key}: {e}")
+
+
+async def store_cache_entries(entries: Dict[str, str], soft_ttl: int, hard_ttl: int):
+    # Same layout fetch_stale_while_revalidate reads, written in one round trip
+    if not entries:
+        return
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for cache_key, value in entries.items():
+                pipe.set(cache_key, value, ex=hard_ttl)
+                pipe.set(f"{cache_key}:fresh", 1, ex=soft_ttl)
+                pipe.delete(f"{cache_key}:refreshing")
+            await pipe.execute()
+        # Other workers drop their local copy and pick up the new value
+        await publish_invalidation(keys=list(entries))
+    except Exception as e:
+        logging.error(f"Error caching {len(entries)} entries: {e}")
+
+
+async def _store_cache_entry(cache_key: str, value: str, soft_ttl: int, hard_ttl: int):
+    await store_cache_entries({cache_key: value}, soft_ttl, hard_ttl)
+
+
+async def _refresh_in_background(
+    cache_key: str, compute: Callable[[], Awaitable[str]], soft_ttl: int, hard_ttl: int
+):
+    try:
+        value = await compute()
+    except Exception as e:
+        logging.error(f"Error refreshing cache entry {cache_key}: {e}")
+        await redis_client.delete(f"{cache_key}:refreshing")
+        return
+    await _store_cache_entry(cache_key, value, soft_ttl, hard_ttl)
+    logging.debug(f"🔄 Refreshed stale cache entry {cache_key}")
+
+
+async def _refresh_many_in_background(
+    cache_keys: List[str],
+    compute: Callable[[List[str]], Awaitable[Dict[str, str]]],
+    soft_ttl: int,
+    hard_ttl: int,
+):
+    try:
+        values = await compute(cache_keys)
+    except Exception as e:
+        logging.error(f"Error refreshing {len(cache_keys)} cache entries: {e}")
+        values, gone = {}, []
+    else:
+        # Entries compute() no longer returns are gone from the source
+        gone = [key for key in cache_keys if key not in values]
+    await store_cache_entries(values, soft_ttl, hard_ttl)
+    unrefreshed = [f"{key}:refreshing" for key in cache_keys if key not in values]
+    try:
+        if unrefreshed:
+            await redis_client.delete(*gone, *unrefreshed)
+        if gone:
+            LOCAL_CACHE.delete(*gone)
+            await publish_invalidation(keys=gone)
+    except Exception as e:
+        logging.error(f"Error unlocking {len(unrefreshed)} cache entries: {e}")
+
+
+async def refresh_stale_entries(
+    cache_keys: List[str],
+    compute: Callable[[List[str]], Awaitable[Dict[str, str]]],
+    soft_ttl: int,
+    hard_ttl: int,
+    refresh_timeout: int = 60,
+):
+    """Batched stale path of fetch_stale_while_revalidate.
+
+    For entries the caller has already served stale: takes each one's
+    refresh lock and recomputes only those this worker won, with a single
+    compute(cache_keys) call in the background.
+    """
+    try:
+        async with redis_client.pipeline(transaction=False) as pipe:
+            for cache_key in cache_keys:
+                pipe.set(f"{cache_key}:refreshing", 1, nx=True, ex=refresh_timeout)
+            acquired = await pipe.execute()
+    except Exception as e:
+        logging.error(f"Error locking {len(cache_keys)} cache entries: {e}")
+        return
+    won = [cache_key for cache_key, ok in zip(cache_keys, acquired) if ok]
+    if won:
+        logging.debug(f"⏳ Serving {len(won)} stale entries while refreshing")
+        task = asyncio.create_task(
+            _refresh_many_in_background(won, compute, soft_ttl, hard_ttl)
+        )
+        _REFRESH_TASKS.add(task)
+        task.add_done_callback(_REFRESH_TASKS.discard)
+
+
+async def fetch_stale_while_revalidate(
+    cache_key: str,
+    compute: Callable[[], Awaitable[str]],
+    soft_ttl: int,
+    hard_ttl: int,
+    refresh_timeout: int = 60,
+) -> str:
+    """Read-through cache for string values with a soft and a hard TTL.
+
+    Fresh hits are returned as-is. Past the soft TTL the stale value is still
+    returned immediately and a single background task (across all workers,
+    guarded by a Redis lock) recomputes it. Past the hard TTL the caller
+    computes the value inline. Values read from Redis are also kept in this
+    worker's LOCAL_CACHE for at most soft_ttl, so hot reads skip Redis.
+    """
+    value = LOCAL_CACHE.get(cache_key)
+    if value is not None:
+        return value
+
+    try:
+        value, fresh = await redis_client.mget(cache_key, f"{cache_key}:fresh")
+    except Exception as e:
+        logging.error(f"Error reading cache entry {cache_key}: {e}")
+        return await compute()
+
+    if value is not None:
+        if fresh is None:
+            # Stale: only the worker that wins the lock recomputes
+            try:
+                acquired = await redis_client.set(
+                    f"{cache_key}:refreshing", 1, nx=True, ex=refresh_timeout
+                )
+            except Exception as e:
+                logging.error(f"Error locking cache entry {cache_key}: {e}")
+                acquired = False
+            if acquired:
+                logging.debug(f"⏳ Serving stale {cache_key} while refreshing")
+                task = asyncio.create_task(
+                    _refresh_in_background(cache_key, compute, soft_ttl, hard_ttl)
+                )
+                _REFRESH_TASKS.add(task)
+                task.add_done_callback(_REFRESH_TASKS.discard)
+        else:
+            LOCAL_CACHE.set(cache_key, value, ttl=min(LOCAL_CACHE.ttl, soft_ttl))
+        return value
+
+    logging.debug(f"❌ Cache miss for {cache_key}, computing inline")
+    value = await compute()
+    await _store_cache_entry(cache_key, value, soft_ttl, hard_ttl)
+    LOCAL_CACHE.set(cache_key, value, ttl=min(LOCAL_CACHE.ttl, soft_ttl))
+    return value
+
 
 # from app import redis_client
 # from app import get_db_connection
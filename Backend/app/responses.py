@@ -0,0 +1,12 @@
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from app.utils import json_dumps
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson and the serialiser registry in app.utils."""
+
+    def render(self, content: Any) -> bytes:
+        return json_dumps(content)
@@ -0,0 +1,166 @@
+import logging
+import os
+import secrets
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, MutableMapping, Optional
+
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.db import redis_client
+from app.utils import json_dumps, json_loads
+
+SESSION_COOKIE_NAME = os.getenv("SESSION_COOKIE_NAME", "session_id")
+# Lifetime of the session cookie, and idle lifetime of the session in Redis
+# (extended each time it is loaded)
+SESSION_MAX_AGE = int(os.getenv("SESSION_MAX_AGE", str(14 * 24 * 3600)))
+SESSION_SAME_SITE = os.getenv("SESSION_SAME_SITE", "lax")
+SESSION_HTTPS_ONLY = os.getenv("SESSION_HTTPS_ONLY", "false").lower() == "true"
+
+SESSION_PREFIX = "session:"
+
+
+def _session_key(session_id: str) -> str:
+    return f"{SESSION_PREFIX}{session_id}"
+
+
+async def _load_session(session_id: str) -> Optional[Dict[str, Any]]:
+    try:
+        # Loading a session also extends its idle lifetime
+        value = await redis_client.getex(_session_key(session_id), ex=SESSION_MAX_AGE)
+    except Exception as e:
+        logging.error(f"Error loading session: {e}")
+        return None
+    return json_loads(value) if value is not None else None
+
+
+class LazySession(MutableMapping[str, Any]):
+    """Session data that is only fetched from Redis when a route asks for it.
+
+    Routes that use the session depend on load_session(); for everything else
+    (the listing, streams, preflights) Redis is never touched. Remembers
+    whether the request changed it, so unchanged sessions are never written.
+    """
+
+    def __init__(self, session_id: Optional[str]):
+        self.session_id = session_id
+        self.modified = False
+        self.rotate = False
+        self._data: Optional[Dict[str, Any]] = None
+        self._on_load: List[Callable[["LazySession"], Awaitable[None]]] = []
+
+    @property
+    def loaded(self) -> bool:
+        return self._data is not None
+
+    def on_load(self, hook: Callable[["LazySession"], Awaitable[None]]):
+        # Run once the session has been fetched, e.g. to refresh its tokens
+        self._on_load.append(hook)
+
+    async def load(self) -> "LazySession":
+        if self._data is None:
+            data = await _load_session(self.session_id) if self.session_id else None
+            if data is None:
+                # Unknown or expired ids are never reused, so a client cannot
+                # pick its own session id
+                self.session_id, data = None, {}
+            self._data = data
+            for hook in self._on_load:
+                await hook(self)
+        return self
+
+    def regenerate_id(self):
+        # Same data under a fresh id, e.g. after login against session fixation
+        self.rotate = self.modified = True
+
+    @property
+    def data(self) -> Dict[str, Any]:
+        if self._data is None:
+            raise RuntimeError("Session not loaded. Depend on load_session first.")
+        return self._data
+
+    def __getitem__(self, key: str) -> Any:
+        return self.data[key]
+
+    def __setitem__(self, key: str, value: Any):
+        self.data[key] = value
+        self.modified = True
+
+    def __delitem__(self, key: str):
+        del self.data[key]
+        self.modified = True
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.data)
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def clear(self):
+        self.data.clear()
+        self.modified = True
+
+
+async def load_session(request: HTTPConnection) -> LazySession:
+    """FastAPI dependency for routes that read or write request.session."""
+    return await request.scope["session"].load()
+
+
+class RedisSessionMiddleware:
+    """Server-side sessions in Redis behind a short opaque session id cookie.
+
+    Stands in for Starlette's SessionMiddleware (scope["session"] is a
+    mapping), but the cookie carries only the id, so sessions are shared by
+    every worker and survive restarts. Redis is only read when a route loads
+    the session, and only written when the request changed it.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        session = LazySession(HTTPConnection(scope).cookies.get(SESSION_COOKIE_NAME))
+        scope["session"] = session
+
+        async def send_wrapper(message: Message):
+            if message["type"] == "http.response.start" and session.modified:
+                cookie = await self._save(session)
+                if cookie is not None:
+                    MutableHeaders(scope=message).append("Set-Cookie", cookie)
+            await send(message)
+
+        await self.app(scope, receive, send_wrapper)
+
+    async def _save(self, session: LazySession) -> Optional[str]:
+        # Returns the Set-Cookie value to send, if the cookie has to change
+        old_id = session.session_id
+        try:
+            if not session:
+                if old_id is not None:
+                    await redis_client.delete(_session_key(old_id))
+                    return self._cookie("", max_age=0)
+                return None
+            new_id = old_id is None or session.rotate
+            session_id = secrets.token_urlsafe(32) if new_id else old_id
+            async with redis_client.pipeline(transaction=True) as pipe:
+                pipe.set(_session_key(session_id), json_dumps(session.data), ex=SESSION_MAX_AGE)
+                if new_id and old_id is not None:
+                    pipe.delete(_session_key(old_id))
+                await pipe.execute()
+            return self._cookie(session_id, max_age=SESSION_MAX_AGE) if new_id else None
+        except Exception as e:
+            logging.error(f"Error saving session: {e}")
+            return None
+
+    def _cookie(self, value: str, max_age: int) -> str:
+        cookie = (
+            f"{SESSION_COOKIE_NAME}={value}; path=/; Max-Age={max_age}; "
+            f"httponly; samesite={SESSION_SAME_SITE}"
+        )
+        if SESSION_HTTPS_ONLY:
+            cookie += "; secure"
+        return cookie
@@ -0,0 +1,34 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, TypeVar
+
+from app.utils import get_md5_hash
+
+T = TypeVar("T")
+
+# Work currently running in this worker, keyed by single_flight_key()
+_IN_FLIGHT: Dict[str, asyncio.Task] = {}
+
+
+def single_flight_key(query: str, *args: Any) -> str:
+    # Whitespace differences in the SQL text must not split callers apart
+    normalized_query = " ".join(query.split())
+    return get_md5_hash(f"{normalized_query}_{args!r}")
+
+
+async def single_flight(key: str, func: Callable[[], Awaitable[T]]) -> T:
+    """Run func once for all concurrent callers sharing the same key.
+
+    The first caller starts the work as a task; everyone arriving while it is
+    still running awaits that same task. The task is shielded, so a caller
+    that gets cancelled (e.g. client disconnect) does not cancel it for the
+    others.
+    """
+    task = _IN_FLIGHT.get(key)
+    if task is None:
+        task = asyncio.create_task(func())
+        _IN_FLIGHT[key] = task
+        task.add_done_callback(lambda _: _IN_FLIGHT.pop(key, None))
+    else:
+        logging.debug(f"🔗 Joining in-flight call {key}")
+    return await asyncio.shield(task)
@@ -1,5 +1,10 @@
 import hashlib
-from datetime import datetime
+from decimal import Decimal
+from typing import Any, Callable, Dict
+from uuid import UUID
+
+import asyncpg
+import orjson
 
 
 def get_md5_hash(input_str: str):
@@ -13,8 +18,57 @@ def get_md5_hash(input_str: str):
     return hash_obj.hexdigest()
 
 
+# Fallback encoders for types orjson does not handle natively, keyed by type.
+# Subclasses are resolved through the MRO, so registering a base type is enough.
+JSON_SERIALISERS: Dict[type, Callable[[Any], Any]] = {}
+
+
+def register_json_serialiser(obj_type: type):
+    def decorator(func: Callable[[Any], Any]):
+        JSON_SERIALISERS[obj_type] = func
+        return func
+
+    return decorator
+
+
+# orjson encodes integers from the signed 64-bit minimum to the unsigned maximum
+_JSON_INT_MIN, _JSON_INT_MAX = -(2**63), 2**64 - 1
+
+
+@register_json_serialiser(Decimal)
+def _serialise_decimal(obj: Decimal):
+    if not obj.is_finite():
+        # Postgres numeric allows NaN and +/-Infinity, which JSON has no number for
+        return str(obj)
+    if obj == obj.to_integral_value() and _JSON_INT_MIN <= obj <= _JSON_INT_MAX:
+        return int(obj)
+    return float(obj)
+
+
+@register_json_serialiser(UUID)
+def _serialise_uuid(obj: UUID):
+    return str(obj)
+
+
+@register_json_serialiser(asyncpg.Record)
+def _serialise_record(obj: asyncpg.Record):
+    return dict(obj.items())
+
+
 def json_serialiser(obj):
-    if isinstance(obj, datetime):
-        return obj.strftime("%Y-%m-%d %h:%M:%S")
+    for obj_type in type(obj).__mro__:
+        serialiser = JSON_SERIALISERS.get(obj_type)
+        if serialiser is not None:
+            return serialiser(obj)
 
     raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+def json_dumps(obj: Any) -> bytes:
+    # orjson encodes datetime, UUID, dataclasses and numpy natively; the
+    # registry above only sees what it cannot handle on its own
+    return orjson.dumps(obj, default=json_serialiser, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_loads(data):
+    return orjson.loads(data)
@@ -1,23 +1,47 @@
 # main.py
+import asyncio
 import logging
 import os
 import sys
 import base64
 import hashlib
-import secrets
 import time
 
-from fastapi import FastAPI, Request, HTTPException
-from fastapi.responses import RedirectResponse, JSONResponse
+from fastapi import Depends, FastAPI, Request, HTTPException
+from fastapi.responses import RedirectResponse
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.sessions import SessionMiddleware
 from starlette.datastructures import URL
 from pydantic import BaseModel
 from dotenv import load_dotenv
-import httpx
-
-from app.db import init_db, redis_client
+from app.auth import (
+    AUTH_URL,
+    CLIENT_ID,
+    LOGOUT_URL,
+    REDIRECT_URI,
+    TOKEN_URL,
+    InvalidToken,
+    TokenRefreshError,
+    access_token_claims,
+    evict_userinfo,
+    get_userinfo,
+    refresh_tokens,
+    store_tokens,
+    user_claims,
+)
+from app.db import (
+    PoolSaturated,
+    close_db,
+    db_pool_metrics,
+    init_db,
+    monitor_replica_health,
+    redis_client,
+)
+from app.http_client import close_http_client, get_http_client, init_http_client
+from app.local_cache import listen_for_invalidations
+from app.notify import listen_for_battery_pack_changes
 from app.middleware import TokenRefreshMiddleware
+from app.sessions import RedisSessionMiddleware, load_session
+from app.responses import FastJSONResponse
 from app.battery_packs import router as battery_packs
 
 # Load environment variables
@@ -30,25 +54,11 @@ logging.basicConfig(
     handlers=[logging.StreamHandler(sys.stdout)],
 )
 
-# OAuth config
-CLIENT_ID = os.getenv("OAUTH_CLIENT_ID")
-AUTH_URL = os.getenv("OAUTH_AUTH_URL")
-TOKEN_URL = os.getenv("OAUTH_TOKEN_URL")
-USERINFO_URL = os.getenv("OAUTH_USERINFO_URL")
-REDIRECT_URI = os.getenv("OAUTH_REDIRECT_URI")
-LOGOUT_URL = os.getenv("OAUTH_LOGOUT_URL")
-
-app = FastAPI()
+app = FastAPI(default_response_class=FastJSONResponse)
 
 # Middlewares
 app.add_middleware(TokenRefreshMiddleware)
-app.add_middleware(
-    SessionMiddleware,
-    secret_key=secrets.token_hex(32),
-    session_cookie="my_session",
-    same_site="lax",
-    https_only=False,
-)
+app.add_middleware(RedisSessionMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -61,6 +71,16 @@ app.add_middleware(
 app.include_router(battery_packs, tags=["battery_packs"])
 
 
+# Load shedding: a saturated DB pool answers fast instead of queueing forever
+@app.exception_handler(PoolSaturated)
+async def pool_saturated_handler(request: Request, exc: PoolSaturated):
+    return FastJSONResponse(
+        status_code=503,
+        content={"detail": str(exc)},
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
 # PKCE generation
 def generate_pkce_pair():
     code_verifier = base64.urlsafe_b64encode(os.urandom(40)).decode("utf-8").rstrip("=")
@@ -76,20 +96,39 @@ def generate_pkce_pair():
 async def startup_event():
     await init_db()
     logging.info("✅ Database pool initialized")
+    init_http_client()
+    app.state.background_tasks = [
+        asyncio.create_task(listen_for_invalidations()),
+        asyncio.create_task(listen_for_battery_pack_changes()),
+        asyncio.create_task(monitor_replica_health()),
+    ]
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
+    for task in app.state.background_tasks:
+        task.cancel()
+    await asyncio.gather(*app.state.background_tasks, return_exceptions=True)
+    logging.info("🛑 Background tasks stopped")
+    await close_http_client()
+    logging.info("🧹 HTTP client closed")
+    await close_db()
+    logging.info("🧹 Database pools closed")
     await redis_client.aclose()
     logging.info("🧹 Redis connection closed")
 
 
+@app.get("/metrics/db_pool")
+def db_pool_stats():
+    return db_pool_metrics()
+
+
 @app.get("/")
 def home():
     return {"message": "You're logged in!"}
 
 
-@app.get("/login")
+@app.get("/login", dependencies=[Depends(load_session)])
 def login(request: Request):
     code_verifier, code_challenge = generate_pkce_pair()
     request.session["code_verifier"] = code_verifier
@@ -105,24 +144,23 @@ def login(request: Request):
     return RedirectResponse(str(url))
 
 
-@app.get("/callback")
+@app.get("/callback", dependencies=[Depends(load_session)])
 async def callback(request: Request, code: str):
     code_verifier = request.session.get("code_verifier")
     if not code_verifier:
         raise HTTPException(status_code=400, detail="Missing code_verifier")
 
-    async with httpx.AsyncClient() as client:
-        token_resp = await client.post(
-            TOKEN_URL,
-            data={
-                "grant_type": "authorization_code",
-                "client_id": CLIENT_ID,
-                "code": code,
-                "redirect_uri": REDIRECT_URI,
-                "code_verifier": code_verifier,
-            },
-            headers={"Content-Type": "application/x-www-form-urlencoded"},
-        )
+    token_resp = await get_http_client().post(
+        TOKEN_URL,
+        data={
+            "grant_type": "authorization_code",
+            "client_id": CLIENT_ID,
+            "code": code,
+            "redirect_uri": REDIRECT_URI,
+            "code_verifier": code_verifier,
+        },
+        headers={"Content-Type": "application/x-www-form-urlencoded"},
+    )
 
     if token_resp.status_code != 200:
         raise HTTPException(
@@ -133,50 +171,45 @@ async def callback(request: Request, code: str):
     request.session["access_token"] = token_data.get("access_token")
     request.session["refresh_token"] = token_data.get("refresh_token")
     request.session["access_token_expires_at"] = time.time() + token_data["expires_in"]
+    # New id once authenticated, so an id planted before login is worthless
+    request.session.regenerate_id()
     return RedirectResponse("http://localhost:3000")
 
 
-@app.get("/me")
+@app.get("/me", dependencies=[Depends(load_session)])
 async def me(request: Request):
     access_token = request.session.get("access_token")
     if not access_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
 
-    expires_at = request.session.get("access_token_expires_at")
-    if expires_at and time.time() >= expires_at:
-        refresh_token = request.session.get("refresh_token")
-        if not refresh_token:
-            raise HTTPException(status_code=401, detail="Refresh token missing")
-
-        async with httpx.AsyncClient() as client:
-            refresh_resp = await client.post(
-                "http://localhost:8000/refresh", json={"refresh_token": refresh_token}
-            )
-
-        if refresh_resp.status_code != 200:
-            raise HTTPException(status_code=401, detail="Failed to refresh token")
-
-        token_data = refresh_resp.json()
-        request.session["access_token"] = token_data["access_token"]
-        request.session["refresh_token"] = token_data["refresh_token"]
-        request.session["access_token_expires_at"] = (
-            time.time() + token_data["expires_in"]
-        )
-        access_token = token_data["access_token"]
+    # Already refreshed if it had expired: loading the session runs
+    # app.middleware.refresh_if_expired.
+    # Validated locally against the cached JWKS when possible: no network call
+    try:
+        claims = await access_token_claims(access_token)
+    except InvalidToken as e:
+        logging.debug(f"Rejected access token: {e}")
+        raise HTTPException(status_code=401, detail="Invalid token")
+    if claims is not None:
+        return FastJSONResponse(content=user_claims(claims))
 
-    async with httpx.AsyncClient() as client:
-        userinfo_resp = await client.get(
-            USERINFO_URL, headers={"Authorization": f"Bearer {access_token}"}
+    # Opaque token or no JWKS: ask the provider, at most once per token lifetime
+    try:
+        userinfo = await get_userinfo(
+            access_token, request.session.get("access_token_expires_at")
         )
-
-    if userinfo_resp.status_code != 200:
+    except InvalidToken as e:
+        logging.debug(f"Rejected access token: {e}")
         raise HTTPException(status_code=401, detail="Invalid token")
 
-    return JSONResponse(content=userinfo_resp.json())
+    return FastJSONResponse(content=userinfo)
 
 
-@app.get("/logout")
-def logout(request: Request):
+@app.get("/logout", dependencies=[Depends(load_session)])
+async def logout(request: Request):
+    access_token = request.session.get("access_token")
+    if access_token:
+        await evict_userinfo(access_token)
     request.session.clear()
     logout_redirect_uri = "http://localhost:3000"
     logout_url = URL(LOGOUT_URL).include_query_params(redirect_uri=logout_redirect_uri)
@@ -194,40 +227,21 @@ class TokenResponse(BaseModel):
     refresh_expires_in: int
 
 
-@app.post("/refresh", response_model=TokenResponse)
+@app.post(
+    "/refresh", response_model=TokenResponse, dependencies=[Depends(load_session)]
+)
 async def refresh_token(request: Request, input: RefreshTokenInput):
     refresh_token = input.refresh_token or request.session.get("refresh_token")
     if not refresh_token:
         raise HTTPException(status_code=400, detail="Missing refresh_token")
 
-    data = {
-        "grant_type": "refresh_token",
-        "refresh_token": refresh_token,
-        "client_id": CLIENT_ID,
-    }
-
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                TOKEN_URL,
-                data=data,
-                headers={"Content-Type": "application/x-www-form-urlencoded"},
-            )
-
-        if response.status_code != 200:
-            raise HTTPException(
-                status_code=response.status_code, detail=response.json()
-            )
-
-        token_data = response.json()
-        request.session["access_token"] = token_data.get("access_token")
-        request.session["refresh_token"] = token_data.get("refresh_token")
-        request.session["access_token_expires_at"] = (
-            time.time() + token_data["expires_in"]
-        )
-
+        token_data = await refresh_tokens(refresh_token)
+        store_tokens(request.session, token_data)
         return token_data
 
+    except TokenRefreshError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
     except Exception as e:
         logging.error(f"Token refresh error: {e}")
         raise HTTPException(status_code=500, detail="Failed to refresh token")
@@ -0,0 +1,109 @@
+-- 001_battery_pack_latest_measurements.sql
+--
+-- Keeps one row per battery pack with its most recent standard measurement so
+-- the battery pack listing no longer has to run DISTINCT ON over the whole
+-- telemetry history on every request.
+--
+-- The index is built CONCURRENTLY, which cannot run inside a transaction
+-- block, so the file is applied as is (psql autocommits the index build; the
+-- rest is wrapped in its own BEGIN/COMMIT):
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/001_battery_pack_latest_measurements.sql
+--
+-- If the concurrent build fails it leaves an INVALID index behind; drop it
+-- with DROP INDEX CONCURRENTLY before re-running.
+
+-- Supports the backfill below and any ad-hoc "latest N for a pack" lookups.
+-- Built without blocking telemetry inserts, however long the history is.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS battery_pack__standard_measurements_identifier_ts_idx
+  ON goodenough.battery_pack__standard_measurements (master_identifier, "timestamp" DESC);
+
+BEGIN;
+
+-- Block concurrent telemetry inserts until the trigger is in place so no row
+-- lands between the backfill snapshot and the trigger taking over. Held only
+-- for the backfill (an index scan now) and the trigger swap.
+LOCK TABLE goodenough.battery_pack__standard_measurements IN SHARE ROW EXCLUSIVE MODE;
+
+-- Latest-state table, created and backfilled from the existing history.
+CREATE TABLE IF NOT EXISTS goodenough.battery_pack__latest_measurements AS
+SELECT DISTINCT ON (sm.master_identifier)
+  sm.master_identifier,
+  sm.master_battery_pack_voltage,
+  sm.master_battery_pack_current,
+  sm."SoC",
+  sm."SoH",
+  sm.battery_pack_state,
+  sm."RCC",
+  sm."SoCS",
+  sm."SoDS",
+  sm."CoC",
+  sm."timestamp"
+FROM goodenough.battery_pack__standard_measurements sm
+WHERE sm.master_identifier IS NOT NULL
+ORDER BY sm.master_identifier, sm."timestamp" DESC;
+
+CREATE UNIQUE INDEX IF NOT EXISTS battery_pack__latest_measurements_identifier_key
+  ON goodenough.battery_pack__latest_measurements (master_identifier);
+
+-- Statement-level trigger: a bulk insert of telemetry performs one set-based
+-- upsert instead of one per row. Out-of-order rows never overwrite newer ones.
+CREATE OR REPLACE FUNCTION goodenough.battery_pack__upsert_latest_measurements()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  INSERT INTO goodenough.battery_pack__latest_measurements AS lm (
+    master_identifier,
+    master_battery_pack_voltage,
+    master_battery_pack_current,
+    "SoC",
+    "SoH",
+    battery_pack_state,
+    "RCC",
+    "SoCS",
+    "SoDS",
+    "CoC",
+    "timestamp"
+  )
+  SELECT DISTINCT ON (nr.master_identifier)
+    nr.master_identifier,
+    nr.master_battery_pack_voltage,
+    nr.master_battery_pack_current,
+    nr."SoC",
+    nr."SoH",
+    nr.battery_pack_state,
+    nr."RCC",
+    nr."SoCS",
+    nr."SoDS",
+    nr."CoC",
+    nr."timestamp"
+  FROM new_rows nr
+  WHERE nr.master_identifier IS NOT NULL
+  ORDER BY nr.master_identifier, nr."timestamp" DESC
+  ON CONFLICT (master_identifier) DO UPDATE SET
+    master_battery_pack_voltage = EXCLUDED.master_battery_pack_voltage,
+    master_battery_pack_current = EXCLUDED.master_battery_pack_current,
+    "SoC" = EXCLUDED."SoC",
+    "SoH" = EXCLUDED."SoH",
+    battery_pack_state = EXCLUDED.battery_pack_state,
+    "RCC" = EXCLUDED."RCC",
+    "SoCS" = EXCLUDED."SoCS",
+    "SoDS" = EXCLUDED."SoDS",
+    "CoC" = EXCLUDED."CoC",
+    "timestamp" = EXCLUDED."timestamp"
+  WHERE lm."timestamp" IS NULL OR EXCLUDED."timestamp" >= lm."timestamp";
+
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS battery_pack__latest_measurements_trg
+  ON goodenough.battery_pack__standard_measurements;
+
+CREATE TRIGGER battery_pack__latest_measurements_trg
+  AFTER INSERT ON goodenough.battery_pack__standard_measurements
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION goodenough.battery_pack__upsert_latest_measurements();
+
+COMMIT;
@@ -0,0 +1,119 @@
+-- 002_battery_pack_trackers.sql
+--
+-- Normalised asset_tag -> tracker mapping extracted from the `battery_pack`
+-- array in traccar.tc_devices.attributes. The battery pack listing joins this
+-- table on asset_tag instead of scanning every device's attributes JSON for
+-- every pack.
+--
+-- Apply with:
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/002_battery_pack_trackers.sql
+
+BEGIN;
+
+-- Keep tc_devices stable until the trigger is in place.
+LOCK TABLE traccar.tc_devices IN SHARE ROW EXCLUSIVE MODE;
+
+CREATE TABLE IF NOT EXISTS traccar.battery_pack_trackers (
+  asset_tag text NOT NULL,
+  device_id bigint NOT NULL,
+  position_tracker_id text NOT NULL,
+  sim_card text,
+  vehicle text,
+  PRIMARY KEY (asset_tag, device_id)
+);
+
+CREATE INDEX IF NOT EXISTS battery_pack_trackers_device_id_idx
+  ON traccar.battery_pack_trackers (device_id);
+
+-- tc_devices.attributes is free-form text written by Traccar; a malformed
+-- value must not break device writes, so it is treated as "no mapping".
+CREATE OR REPLACE FUNCTION traccar.try_jsonb(value text)
+RETURNS jsonb
+LANGUAGE plpgsql
+IMMUTABLE
+AS $$
+BEGIN
+  RETURN value::jsonb;
+EXCEPTION WHEN others THEN
+  RETURN NULL;
+END;
+$$;
+
+-- Full rebuild, used for the initial backfill and as a manual repair tool.
+CREATE OR REPLACE FUNCTION traccar.battery_pack_trackers_rebuild()
+RETURNS void
+LANGUAGE sql
+AS $$
+  DELETE FROM traccar.battery_pack_trackers;
+
+  INSERT INTO traccar.battery_pack_trackers (asset_tag, device_id, position_tracker_id, sim_card, vehicle)
+  SELECT DISTINCT ON (bp->>'asset_tag', d.id)
+    bp->>'asset_tag',
+    d.id,
+    d.uniqueid,
+    d.attrs->>'SIM_card',
+    d.attrs->>'vehicle'
+  FROM (
+    SELECT td.id, td.uniqueid, traccar.try_jsonb(td.attributes) AS attrs
+    FROM traccar.tc_devices td
+  ) d
+  CROSS JOIN LATERAL jsonb_array_elements(
+    CASE WHEN jsonb_typeof(d.attrs->'battery_pack') = 'array'
+         THEN d.attrs->'battery_pack'
+         ELSE '[]'::jsonb END
+  ) AS bp
+  WHERE bp->>'asset_tag' IS NOT NULL;
+$$;
+
+-- Incremental refresh for a single device row.
+CREATE OR REPLACE FUNCTION traccar.battery_pack_trackers_refresh()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  attrs jsonb;
+BEGIN
+  IF TG_OP IN ('UPDATE', 'DELETE') THEN
+    DELETE FROM traccar.battery_pack_trackers WHERE device_id = OLD.id;
+  END IF;
+
+  IF TG_OP = 'DELETE' THEN
+    RETURN NULL;
+  END IF;
+
+  attrs := traccar.try_jsonb(NEW.attributes);
+  IF jsonb_typeof(attrs->'battery_pack') = 'array' THEN
+    INSERT INTO traccar.battery_pack_trackers (asset_tag, device_id, position_tracker_id, sim_card, vehicle)
+    SELECT DISTINCT
+      bp->>'asset_tag',
+      NEW.id,
+      NEW.uniqueid,
+      attrs->>'SIM_card',
+      attrs->>'vehicle'
+    FROM jsonb_array_elements(attrs->'battery_pack') AS bp
+    WHERE bp->>'asset_tag' IS NOT NULL;
+  END IF;
+
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS battery_pack_trackers_insert_delete_trg ON traccar.tc_devices;
+DROP TRIGGER IF EXISTS battery_pack_trackers_update_trg ON traccar.tc_devices;
+
+CREATE TRIGGER battery_pack_trackers_insert_delete_trg
+  AFTER INSERT OR DELETE ON traccar.tc_devices
+  FOR EACH ROW
+  EXECUTE FUNCTION traccar.battery_pack_trackers_refresh();
+
+-- Traccar touches tc_devices on every position update; only react when the
+-- columns feeding the mapping actually change.
+CREATE TRIGGER battery_pack_trackers_update_trg
+  AFTER UPDATE OF attributes, uniqueid ON traccar.tc_devices
+  FOR EACH ROW
+  WHEN (OLD.attributes IS DISTINCT FROM NEW.attributes OR OLD.uniqueid IS DISTINCT FROM NEW.uniqueid)
+  EXECUTE FUNCTION traccar.battery_pack_trackers_refresh();
+
+SELECT traccar.battery_pack_trackers_rebuild();
+
+COMMIT;
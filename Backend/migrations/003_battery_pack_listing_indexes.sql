@@ -0,0 +1,11 @@
+-- 003_battery_pack_listing_indexes.sql
+--
+-- Lets the paginated battery pack listing walk assets in asset_tag order for a
+-- single model and stop after one page, instead of sorting the whole fleet.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so apply
+-- this file without wrapping it in BEGIN/COMMIT:
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/003_battery_pack_listing_indexes.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS assets_model_id_asset_tag_idx
+  ON "snipe-it".assets (model_id, asset_tag);
@@ -0,0 +1,191 @@
+-- 004_battery_pack_change_notifications.sql
+--
+-- Publishes the asset_tags of battery packs whose listed data changed on the
+-- `battery_pack_changes` NOTIFY channel. The backend listens on it (see
+-- app/notify.py) and marks exactly the affected cache entries stale, so caches
+-- can live long without serving outdated data.
+--
+-- Payload: {"txid": ..., "asset_tags": [...], "reindex": ...} where "reindex"
+-- says which cached filter indexes the change can affect:
+--   "all"           a field a listing filter (or membership) depends on changed
+--   "measurements"  only the latest state, SoC or SoH (or the tracker feeding
+--                   them) changed; indexes without those filters stay valid
+--   null            nothing a filter looks at changed; only the packs' JSON did
+-- txid makes each notification unique, so the worker that claims it in Redis
+-- is the only one to act on it there.
+--
+-- Sources:
+--   * "snipe-it".assets                          asset fields, status, location...
+--   * traccar.battery_pack_trackers              tracker / SIM / vehicle links;
+--                                                this is derived from tc_devices
+--                                                (migration 002) and only changes
+--                                                when the mapping really does
+--   * goodenough.battery_pack__latest_measurements  latest telemetry per pack
+--                                                (migration 001), so OLD and NEW
+--                                                values can be compared
+--
+-- Apply with:
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/004_battery_pack_change_notifications.sql
+
+BEGIN;
+
+-- Resolves telemetry rows (keyed by tracker uniqueid) back to asset_tags.
+CREATE INDEX IF NOT EXISTS battery_pack_trackers_position_tracker_id_idx
+  ON traccar.battery_pack_trackers (position_tracker_id);
+
+-- NOTIFY payloads are capped at 8000 bytes; past that, ask for a full flush.
+DROP FUNCTION IF EXISTS goodenough.notify_battery_pack_changes(text[]);
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_changes(asset_tags text[], reindex text)
+RETURNS void
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  payload text;
+BEGIN
+  IF asset_tags IS NULL OR cardinality(asset_tags) = 0 THEN
+    RETURN;
+  END IF;
+
+  payload := jsonb_build_object(
+    'txid', txid_current(),
+    'asset_tags', to_jsonb(asset_tags),
+    'reindex', reindex
+  )::text;
+  IF octet_length(payload) > 7900 THEN
+    payload := jsonb_build_object('txid', txid_current(), 'all', true)::text;
+  END IF;
+
+  PERFORM pg_notify('battery_pack_changes', payload);
+END;
+$$;
+
+-- Row triggers: identical payloads within one transaction are folded by
+-- Postgres, so a multi-row update of one asset still sends one notification.
+-- An asset edit only reindexes when it touches a column the listing filters
+-- on or selects packs by.
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_asset_change()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM goodenough.notify_battery_pack_changes(ARRAY[NEW.asset_tag::text], 'all');
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM goodenough.notify_battery_pack_changes(ARRAY[OLD.asset_tag::text], 'all');
+  ELSE
+    PERFORM goodenough.notify_battery_pack_changes(
+      ARRAY(SELECT DISTINCT t FROM unnest(ARRAY[OLD.asset_tag::text, NEW.asset_tag::text]) t),
+      CASE WHEN (OLD.asset_tag, OLD.model_id, OLD.deleted_at, OLD.status_id, OLD.company_id, OLD.location_id)
+                IS DISTINCT FROM
+                (NEW.asset_tag, NEW.model_id, NEW.deleted_at, NEW.status_id, NEW.company_id, NEW.location_id)
+           THEN 'all' END
+    );
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+-- A tracker link only decides which measurements a pack shows
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_tracker_change()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF TG_OP = 'INSERT' THEN
+    PERFORM goodenough.notify_battery_pack_changes(ARRAY[NEW.asset_tag::text], 'measurements');
+  ELSIF TG_OP = 'DELETE' THEN
+    PERFORM goodenough.notify_battery_pack_changes(ARRAY[OLD.asset_tag::text], 'measurements');
+  ELSE
+    PERFORM goodenough.notify_battery_pack_changes(
+      ARRAY(SELECT DISTINCT t FROM unnest(ARRAY[OLD.asset_tag::text, NEW.asset_tag::text]) t),
+      'measurements'
+    );
+  END IF;
+  RETURN NULL;
+END;
+$$;
+
+DROP FUNCTION IF EXISTS goodenough.notify_battery_pack_row_change() CASCADE;
+
+DROP TRIGGER IF EXISTS battery_pack_changes_notify_trg ON "snipe-it".assets;
+CREATE TRIGGER battery_pack_changes_notify_trg
+  AFTER INSERT OR UPDATE OR DELETE ON "snipe-it".assets
+  FOR EACH ROW
+  EXECUTE FUNCTION goodenough.notify_battery_pack_asset_change();
+
+DROP TRIGGER IF EXISTS battery_pack_changes_notify_trg ON traccar.battery_pack_trackers;
+CREATE TRIGGER battery_pack_changes_notify_trg
+  AFTER INSERT OR UPDATE OR DELETE ON traccar.battery_pack_trackers
+  FOR EACH ROW
+  EXECUTE FUNCTION goodenough.notify_battery_pack_tracker_change();
+
+-- Telemetry arrives in bulk and is upserted into the latest-state table once
+-- per statement, so these fire once per telemetry insert with every affected
+-- pack. Transition tables allow only one event per trigger, hence two.
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_measurements_inserted()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- A pack's first measurement gives it a state, SoC and SoH to filter on
+  PERFORM goodenough.notify_battery_pack_changes(ARRAY(
+    SELECT DISTINCT bt.asset_tag
+    FROM new_rows nr
+    JOIN traccar.battery_pack_trackers bt
+      ON bt.position_tracker_id = nr.master_identifier::text
+  ), 'measurements');
+  RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_measurements_updated()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  -- Packs whose filtered values moved, and packs where only the rest did
+  PERFORM goodenough.notify_battery_pack_changes(ARRAY(
+    SELECT DISTINCT bt.asset_tag
+    FROM new_rows nr
+    JOIN old_rows o ON o.master_identifier = nr.master_identifier
+    JOIN traccar.battery_pack_trackers bt
+      ON bt.position_tracker_id = nr.master_identifier::text
+    WHERE (o.battery_pack_state, o."SoC", o."SoH")
+          IS DISTINCT FROM (nr.battery_pack_state, nr."SoC", nr."SoH")
+  ), 'measurements');
+  PERFORM goodenough.notify_battery_pack_changes(ARRAY(
+    SELECT DISTINCT bt.asset_tag
+    FROM new_rows nr
+    JOIN old_rows o ON o.master_identifier = nr.master_identifier
+    JOIN traccar.battery_pack_trackers bt
+      ON bt.position_tracker_id = nr.master_identifier::text
+    WHERE (o.battery_pack_state, o."SoC", o."SoH")
+          IS NOT DISTINCT FROM (nr.battery_pack_state, nr."SoC", nr."SoH")
+      AND o IS DISTINCT FROM nr
+  ), NULL);
+  RETURN NULL;
+END;
+$$;
+
+-- Replaced by the latest-state triggers below, which can tell what changed
+DROP TRIGGER IF EXISTS battery_pack_changes_notify_trg
+  ON goodenough.battery_pack__standard_measurements;
+DROP FUNCTION IF EXISTS goodenough.notify_battery_pack_measurements();
+
+DROP TRIGGER IF EXISTS battery_pack_changes_inserted_notify_trg
+  ON goodenough.battery_pack__latest_measurements;
+CREATE TRIGGER battery_pack_changes_inserted_notify_trg
+  AFTER INSERT ON goodenough.battery_pack__latest_measurements
+  REFERENCING NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION goodenough.notify_battery_pack_measurements_inserted();
+
+DROP TRIGGER IF EXISTS battery_pack_changes_updated_notify_trg
+  ON goodenough.battery_pack__latest_measurements;
+CREATE TRIGGER battery_pack_changes_updated_notify_trg
+  AFTER UPDATE ON goodenough.battery_pack__latest_measurements
+  REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+  FOR EACH STATEMENT
+  EXECUTE FUNCTION goodenough.notify_battery_pack_measurements_updated();
+
+COMMIT;
@@ -0,0 +1,56 @@
+-- 005_battery_pack_measurement_deltas.sql
+--
+-- Emits one `battery_pack_measurements` NOTIFY per pack whose latest
+-- measurement changed, carrying the new values in the same shape as the
+-- `battery_pack` block of the listing. Every backend worker LISTENs on the
+-- channel (app/notify.py) and hands the deltas straight to its own clients of
+-- the live event stream (GET /battery_packs/events).
+--
+-- Fires on the latest-state table from migration 001, which is upserted once
+-- per pack per telemetry insert statement.
+--
+-- Apply with:
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/005_battery_pack_measurement_deltas.sql
+
+BEGIN;
+
+CREATE OR REPLACE FUNCTION goodenough.notify_battery_pack_measurement_delta()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+DECLARE
+  tag text;
+BEGIN
+  FOR tag IN
+    SELECT bt.asset_tag
+    FROM traccar.battery_pack_trackers bt
+    WHERE bt.position_tracker_id = NEW.master_identifier::text
+  LOOP
+    PERFORM pg_notify('battery_pack_measurements', jsonb_build_object(
+      'asset_tag', tag,
+      'battery_pack', jsonb_build_object(
+        'battery_pack_state', COALESCE(NEW.battery_pack_state, ''),
+        'CoC', COALESCE(NEW."CoC", 0),
+        'electrical_data_updatedAt', COALESCE(to_char(NEW."timestamp", 'YYYY-MM-DD"T"HH24:MI:SS+00:00'), ''),
+        'master_battery_pack_current', COALESCE(NEW.master_battery_pack_current, 0),
+        'master_battery_pack_voltage', COALESCE(NEW.master_battery_pack_voltage, 0),
+        'RCC', COALESCE(NEW."RCC", 0),
+        'SoC', COALESCE(NEW."SoC", 0),
+        'SoCS', COALESCE(NEW."SoCS", ''),
+        'SoDS', COALESCE(NEW."SoDS", ''),
+        'SoH', COALESCE(NEW."SoH", 0)
+      )
+    )::text);
+  END LOOP;
+  RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS battery_pack_measurement_delta_trg
+  ON goodenough.battery_pack__latest_measurements;
+CREATE TRIGGER battery_pack_measurement_delta_trg
+  AFTER INSERT OR UPDATE ON goodenough.battery_pack__latest_measurements
+  FOR EACH ROW
+  EXECUTE FUNCTION goodenough.notify_battery_pack_measurement_delta();
+
+COMMIT;
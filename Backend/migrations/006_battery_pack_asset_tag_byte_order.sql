@@ -0,0 +1,15 @@
+-- 006_battery_pack_asset_tag_byte_order.sql
+--
+-- The battery pack listing pages by asset_tag in byte order (COLLATE "C"), the
+-- order the Redis indexes and the cursor comparisons use. An index is only
+-- used for an ORDER BY / range scan in its own collation, so this adds the
+-- byte-ordered twin of assets_model_id_asset_tag_idx (migration 003). That
+-- one stays: the single-pack lookup compares asset_tag in the default
+-- collation.
+--
+-- CREATE INDEX CONCURRENTLY cannot run inside a transaction block, so apply
+-- this file without wrapping it in BEGIN/COMMIT:
+--   psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/006_battery_pack_asset_tag_byte_order.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS assets_model_id_asset_tag_c_idx
+  ON "snipe-it".assets (model_id, asset_tag COLLATE "C");
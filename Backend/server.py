@@ -0,0 +1,63 @@
+# server.py
+"""Production entrypoint: python -m server
+
+Runs main:app under gunicorn with uvicorn workers on uvloop and httptools,
+one worker per available CPU unless WEB_CONCURRENCY says otherwise. Workers
+are recycled after SERVER_MAX_REQUESTS requests (with jitter, so they do not
+all restart at once). On SIGTERM in-flight requests get
+SERVER_GRACEFUL_TIMEOUT seconds to finish before the app's shutdown handler
+closes the pools. For development keep using uvicorn main:app --reload.
+"""
+
+import os
+
+from gunicorn.app.base import BaseApplication
+from uvicorn.workers import UvicornWorker
+
+
+class ProductionUvicornWorker(UvicornWorker):
+    CONFIG_KWARGS = {"loop": "uvloop", "http": "httptools", "lifespan": "on"}
+
+
+def default_workers() -> int:
+    # CPUs this process may actually run on (cgroup/affinity aware)
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def server_options() -> dict:
+    return {
+        "bind": f"{os.getenv('HOST', '0.0.0.0')}:{os.getenv('PORT', '8000')}",
+        "workers": int(os.getenv("WEB_CONCURRENCY", str(default_workers()))),
+        "worker_class": ProductionUvicornWorker,
+        "max_requests": int(os.getenv("SERVER_MAX_REQUESTS", "10000")),
+        "max_requests_jitter": int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "1000")),
+        "graceful_timeout": int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "30")),
+        "timeout": int(os.getenv("SERVER_WORKER_TIMEOUT", "60")),
+        "keepalive": int(os.getenv("SERVER_KEEPALIVE", "5")),
+        "accesslog": os.getenv("SERVER_ACCESS_LOG"),
+    }
+
+
+class Server(BaseApplication):
+    def __init__(self, options: dict):
+        self.options = options
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        # Imported in each worker after the fork, so every worker builds its
+        # own event loop, pools and background tasks
+        from main import app
+
+        return app
+
+
+if __name__ == "__main__":
+    Server(server_options()).run()